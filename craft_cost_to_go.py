@@ -0,0 +1,161 @@
+import json
+import os
+from collections import namedtuple
+from hashlib import sha1
+from heapq import heappop, heappush
+from timeit import default_timer as time
+
+import numpy as np
+
+from craft_planner import recipe_set_hash
+from craft_replanner import make_regressor
+
+# requirements[i] is the least inventory from which the goal can be reached in costs[i] Time; rows
+# are in order of cost. Every requirement cheaper than bound is in the table, and complete means
+# the backward search ran out of requirements, so a state satisfying none can't reach the goal.
+CostToGo = namedtuple('CostToGo', ['items', 'requirements', 'costs', 'bound', 'complete'])
+max_entries = 100000
+build_limit = 60
+chunk_size = 4000000
+
+
+def dominated(candidates, settled):
+    # Which candidates are componentwise at least some settled requirement, compared a chunk of
+    # candidates at a time so no more than about chunk_size booleans are held at once.
+    result = np.zeros(len(candidates), dtype=bool)
+    if len(settled) == 0:
+        return result
+    step = max(1, chunk_size // (len(settled) * candidates.shape[1]))
+    for start in range(0, len(candidates), step):
+        chunk = candidates[start:start + step]
+        result[start:start + step] = (settled[None, :, :] <= chunk[:, None, :]).all(axis=2).any(axis=1)
+    return result
+
+
+def build_cost_to_go(crafting, limit=build_limit, entries=max_entries):
+    # Backward uniform-cost search from the goal over requirements, regressing through each recipe
+    # as craft_replanner does (the make_deffector semantics on tuples). The exact cost-to-go of a
+    # state is the cost of the cheapest requirement it satisfies, so a requirement which satisfies
+    # a cheaper one is useless and isn't kept or regressed further: anything regressed from it
+    # would satisfy something regressed from the cheaper one. That pruning is what keeps the table
+    # small. Requirements of equal cost are settled together so the check is one numpy operation.
+    # Stops after limit seconds or once entries requirements are kept.
+    items = list(crafting['Items'])
+    index = dict((item, i) for i, item in enumerate(items))
+    regressors = [(rule['Time'], make_regressor(rule, index)) for rule in crafting['Recipes'].values()]
+    goal = tuple(crafting['Goal'].get(item, 0) for item in items)
+    best = {goal: 0}
+    queue = [(0, goal)]
+    settled = np.zeros((0, len(items)), dtype=np.int64)
+    costs = []
+    start_time = time()
+    while queue and time() - start_time < limit and len(costs) < entries:
+        cost = queue[0][0]
+        level = []
+        while queue and queue[0][0] == cost:
+            requirement_cost, requirement = heappop(queue)
+            if requirement_cost == best[requirement]:
+                level.append(requirement)
+        if not level:
+            continue
+        candidates = np.array(level, dtype=np.int64)
+        candidates = candidates[~dominated(candidates, settled)]
+        if len(candidates) > 1:
+            within = (candidates[None, :, :] <= candidates[:, None, :]).all(axis=2)
+            np.fill_diagonal(within, False)
+            candidates = candidates[~within.any(axis=1)]
+        settled = np.concatenate([settled, candidates])
+        costs += [cost] * len(candidates)
+        for requirement in map(tuple, candidates.tolist()):
+            for time_cost, regress in regressors:
+                previous = regress(requirement)
+                if previous is None or previous == requirement:
+                    continue
+                if cost + time_cost < best.get(previous, float('inf')):
+                    best[previous] = cost + time_cost
+                    heappush(queue, (cost + time_cost, previous))
+    complete = not queue
+    bound = costs[-1] if complete else queue[0][0]
+    dtype = np.uint16 if settled.size == 0 or settled.max() < np.iinfo(np.uint16).max else np.uint32
+    return CostToGo(items, settled.astype(dtype), np.array(costs, dtype=np.float64), bound, complete)
+
+
+def cost_to_go_file(crafting, directory='.'):
+    # Cached per recipe set and goal, as three files sharing this prefix.
+    goal = sha1(json.dumps(crafting['Goal'], sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(directory, 'ctg_' + recipe_set_hash(crafting) + '_' + goal)
+
+
+def save_cost_to_go(path, table):
+    # Each file is written under a temporary name and moved into place, the JSON last since its
+    # presence marks the table as ready; processes building the same table at once don't clash.
+    for suffix, array in (('.requirements.npy', table.requirements), ('.costs.npy', table.costs)):
+        with open(path + suffix + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + suffix + '.tmp', path + suffix)
+    with open(path + '.json.tmp', 'w') as f:
+        json.dump({'items': table.items, 'bound': table.bound, 'complete': table.complete}, f)
+    os.replace(path + '.json.tmp', path + '.json')
+
+
+def load_cost_to_go(path):
+    # The arrays are memory-mapped, so every process using the table shares one copy in the page
+    # cache and loading costs next to nothing however big it is.
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    return CostToGo(meta['items'], np.load(path + '.requirements.npy', mmap_mode='r'),
+                    np.load(path + '.costs.npy', mmap_mode='r'), meta['bound'], meta['complete'])
+
+
+def get_cost_to_go(crafting, directory='.'):
+    # Loads the cost-to-go table for this recipe set and goal from disk, building it first if it
+    # isn't cached yet.
+    path = cost_to_go_file(crafting, directory)
+    if not os.path.exists(path + '.json'):
+        save_cost_to_go(path, build_cost_to_go(crafting))
+    return load_cost_to_go(path)
+
+
+def make_cost_to_go_heuristic(table, fallback):
+    # Returns a heuristic giving the exact cost-to-go of any state which satisfies a requirement in
+    # the table: the cost of the first one it satisfies, rows being in order of cost. Other states
+    # are at least table.bound from the goal; they get table.bound plus fallback(state), so they
+    # rank behind every state in the table, or infinity if the table is complete.
+    # Only rows needing none of the items the state lacks are compared in full; which items a row
+    # needs is kept as a bit mask over the first 62 items, enough to rule out most rows in one pass.
+    requirements, costs = table.requirements, table.costs
+    beyond = float('inf') if table.complete else table.bound
+    bits = np.left_shift(1, np.arange(min(len(table.items), 62)), dtype=np.int64)
+    needs = (requirements[:, :len(bits)] > 0) @ bits
+
+    def heuristic(state):
+        have = np.array([state[item] for item in table.items])
+        lacking = int(bits[have[:len(bits)] == 0].sum())
+        rows = np.flatnonzero((needs & lacking) == 0)
+        if len(rows):
+            satisfied = (requirements[rows] <= have).all(axis=1)
+            first = satisfied.argmax()
+            if satisfied[first]:
+                return costs[rows[first]].item()
+        return beyond + fallback(state)
+
+    return heuristic
+
+
+def print_cost_to_go_report(table):
+    print("Cost-to-go table: " + str(len(table.costs)) + " requirements, " +
+          ("complete" if table.complete else "exact below " + str(table.bound)))
+
+
+if __name__ == '__main__':
+    import sys
+    # Usage: python craft_cost_to_go.py [Crafting.json] [seconds]
+    # Precomputes the table for the file's goal; later runs with use_cost_to_go load it.
+    from craft_planner import prune_irrelevant
+    with open(sys.argv[1] if len(sys.argv) > 1 else 'Crafting.json') as f:
+        Crafting, _ = prune_irrelevant(json.load(f))
+    start = time()
+    table = build_cost_to_go(Crafting, float(sys.argv[2]) if len(sys.argv) > 2 else build_limit)
+    save_cost_to_go(cost_to_go_file(Crafting), table)
+    print_cost_to_go_report(table)
+    print("Build time: %.2f seconds" % (time() - start))
@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+from timeit import default_timer as time
+
+import numpy as np
+
+from craft_validator import compile_recipes
+
+# Records are written as int64: a bucket row is (node id, item quantities...), a parent row is
+# (parent node id, recipe index).
+chunk_rows = 65536
+max_runs = 8
+
+
+class DiskBudgetExceeded(Exception):
+    pass
+
+
+class ExternalStore:
+    """ Files backing an external-memory search: one append-only bucket file per g-value, sorted
+        runs of closed state keys, and an append-only parent file indexed by node id. Only the
+        chunk being expanded and the keys of one bucket are ever held in memory.
+    """
+
+    def __init__(self, width, directory=None, max_disk_bytes=None):
+        self.width = width
+        self.directory = tempfile.mkdtemp(prefix='craft_external_', dir=directory)
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = 0
+        self.runs = []
+        # Run files are numbered from a counter, never from what is on disk, since bucket and
+        # merged run files are deleted as the search goes.
+        self.run_count = 0
+        self.nodes = 0
+        self.parents = open(os.path.join(self.directory, 'parents.bin'), 'wb')
+
+    def close(self):
+        self.parents.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def account(self, size):
+        self.disk_bytes += size
+        if self.max_disk_bytes is not None and self.disk_bytes > self.max_disk_bytes:
+            raise DiskBudgetExceeded(self.disk_bytes)
+
+    def bucket_path(self, f):
+        return os.path.join(self.directory, 'bucket_%d.bin' % f)
+
+    def append(self, f, states, parents, recipes):
+        # Gives the new nodes ids, records their parents and appends them to bucket f.
+        ids = np.arange(self.nodes, self.nodes + len(states), dtype=np.int64)
+        self.nodes += len(states)
+        links = np.column_stack([parents, recipes]).astype(np.int64)
+        rows = np.column_stack([ids, states]).astype(np.int64)
+        self.parents.write(links.tobytes())
+        with open(self.bucket_path(f), 'ab') as bucket:
+            bucket.write(rows.tobytes())
+        self.account(links.nbytes + rows.nbytes)
+
+    def read_bucket(self, f):
+        path = self.bucket_path(f)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        return np.memmap(path, dtype=np.int64, mode='r').reshape(-1, self.width + 1)
+
+    def keys(self, states):
+        states = np.ascontiguousarray(states, dtype=np.int64)
+        return states.view(np.dtype((np.void, 8 * self.width))).ravel()
+
+    def is_closed(self, keys):
+        closed = np.zeros(len(keys), dtype=bool)
+        for path, length in self.runs:
+            run = np.memmap(path, dtype=np.dtype((np.void, 8 * self.width)), mode='r', shape=(length,))
+            index = np.minimum(np.searchsorted(run, keys), length - 1)
+            closed |= run[index] == keys
+        return closed
+
+    def add_run(self, keys):
+        # Stores a sorted run of closed keys, merging all runs into one when there get to be many.
+        if len(keys) == 0:
+            return
+        path = os.path.join(self.directory, 'closed_%d.bin' % self.run_count)
+        self.run_count += 1
+        keys.tofile(path)
+        self.account(keys.nbytes)
+        self.runs.append((path, len(keys)))
+        if len(self.runs) > max_runs:
+            merged = np.sort(np.concatenate([np.fromfile(p, dtype=keys.dtype) for p, _ in self.runs]))
+            for p, _ in self.runs:
+                os.remove(p)
+            self.account(-sum(length for _, length in self.runs) * keys.dtype.itemsize)
+            self.runs = []
+            self.add_run(merged)
+
+    def path_to(self, node, names):
+        links = np.memmap(self.parents.name, dtype=np.int64, mode='r').reshape(-1, 2)
+        path = []
+        while links[node][0] >= 0:
+            path.append(names[links[node][1]])
+            node = int(links[node][0])
+        return path[::-1]
+
+
+def external_search(crafting, state, limit, directory=None, max_disk_bytes=None):
+    # Uniform-cost search whose open and closed lists live on disk, in the style of delayed
+    # duplicate detection: successors are appended to the bucket of their g-value without any
+    # duplicate checks; when a bucket comes up, it is deduplicated in bulk by sorting, states
+    # already in a closed run are dropped, and the survivors become a new sorted closed run before
+    # being expanded chunk by chunk with the compiled recipe matrices.
+    # Returns (path, computation time, number of nodes generated) like search(), or None.
+    start_time = time()
+    compiled = compile_recipes(crafting)
+    width = len(compiled.items)
+    goal = np.array([crafting['Goal'].get(item, 0) for item in compiled.items], dtype=np.int64)
+    initial = np.array([[state.get(item, 0) for item in compiled.items]], dtype=np.int64)
+    store = ExternalStore(width, directory, max_disk_bytes)
+    try:
+        store.append(0, initial, [-1], [-1])
+        f = 0
+        pending = {0}
+        while pending and time() - start_time < limit:
+            f = min(pending)
+            pending.discard(f)
+            store.parents.flush()
+            bucket = store.read_bucket(f)
+            if bucket is None:
+                continue
+            keys = store.keys(bucket[:, 1:])
+            keys, first = np.unique(keys, return_index=True)
+            fresh = ~store.is_closed(keys)
+            keys, first = keys[fresh], first[fresh]
+            store.add_run(keys)
+            ids = np.asarray(bucket[first, 0])
+            states = np.asarray(bucket[first, 1:])
+            store.account(-bucket.nbytes)
+            del bucket
+            os.remove(store.bucket_path(f))
+            reached = np.nonzero((states >= goal).all(axis=1))[0]
+            if reached.size:
+                store.parents.flush()
+                path = store.path_to(int(ids[reached[0]]), compiled.names)
+                return (path, time() - start_time, store.nodes)
+            for begin in range(0, len(states), chunk_rows):
+                chunk, chunk_ids = states[begin:begin + chunk_rows], ids[begin:begin + chunk_rows]
+                for r in range(len(compiled.names)):
+                    applicable = np.nonzero((chunk >= compiled.need[r]).all(axis=1))[0]
+                    if applicable.size == 0:
+                        continue
+                    successor_f = f + int(compiled.time[r])
+                    store.append(successor_f, chunk[applicable] + compiled.delta[r], chunk_ids[applicable],
+                                 np.full(applicable.size, r))
+                    pending.add(successor_f)
+        print("Failed to find a path from", state, 'within time limit.')
+        return None
+    except DiskBudgetExceeded as exceeded:
+        print("Failed to find a path from", state, 'within the disk budget (%d bytes).' % exceeded.args[0])
+        return None
+    finally:
+        store.close()
+
+
+def synthetic_domain(width, depth):
+    # A recipe set of width independent chains of depth items each, every stage making 2 of the
+    # next from 1 of the previous, with the last item of every chain as the goal. The reachable
+    # state space grows roughly like depth ** width, so it can be made larger than memory.
+    items = ['item_%d_%d' % (chain, stage) for chain in range(width) for stage in range(depth)]
+    recipes = {}
+    for chain in range(width):
+        recipes['gather %d' % chain] = {'Produces': {'item_%d_0' % chain: 1}, 'Time': 2}
+        for stage in range(1, depth):
+            recipes['refine %d %d' % (chain, stage)] = {
+                'Consumes': {'item_%d_%d' % (chain, stage - 1): 1},
+                'Produces': {'item_%d_%d' % (chain, stage): 2}, 'Time': 1}
+    goal = dict(('item_%d_%d' % (chain, depth - 1), 1) for chain in range(width))
+    return {'Items': items, 'Initial': {}, 'Goal': goal, 'Recipes': recipes}
+
+
+if __name__ == '__main__':
+    import sys
+    # Usage: python craft_external.py [chains] [depth] [disk budget in MB]
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    budget = int(sys.argv[3]) * 2 ** 20 if len(sys.argv) > 3 else None
+    results = external_search(synthetic_domain(width, depth), {}, 600, max_disk_bytes=budget)
+    if results is not None:
+        print("Plan length: " + str(len(results[0])))
+        print("Computation time: " + str(results[1]) + " seconds")
+        print("Number of states: " + str(results[2]))
+        print("Throughput: " + str(int(results[2] / results[1])) + " states/second")
@@ -0,0 +1,73 @@
+import numpy as np
+
+from craft_planner import make_heuristic
+
+max_pivots = 200
+
+
+def compile_counting_lp(crafting):
+    # Operator-counting relaxation: one variable per recipe for how often it is applied, and one
+    # constraint per item saying the recipes' net production of it covers the goal minus what the
+    # state holds. Minimizing total Time over that gives a lower bound on the cost-to-goal.
+    # Requires are ignored, as is the order in which recipes run.
+    items = list(crafting['Items'])
+    names = list(crafting['Recipes'].keys())
+    delta = np.zeros((len(items), len(names)))
+    for r, name in enumerate(names):
+        rule = crafting['Recipes'][name]
+        for item, quantity in rule['Produces'].items():
+            delta[items.index(item), r] += quantity
+        for item, quantity in rule.get('Consumes', {}).items():
+            delta[items.index(item), r] -= quantity
+    goal = np.array([crafting['Goal'].get(item, 0) for item in items], dtype=float)
+    cost = np.array([crafting['Recipes'][name]['Time'] for name in names], dtype=float)
+    # Standard form: [delta, -I] z = goal - state, z >= 0, the last len(items) columns surplus.
+    matrix = np.hstack([delta, -np.eye(len(items))])
+    costs = np.concatenate([cost, np.zeros(len(items))])
+    return items, matrix, costs, goal
+
+
+def dual_simplex(matrix, costs, rhs, basis):
+    # Dual simplex on min costs.z s.t. matrix z = rhs, z >= 0, starting from a dual feasible basis.
+    # Every recipe Time is positive, so the all-surplus basis is always dual feasible, and so is
+    # any optimal basis of a state differing only in rhs: that is what makes warm starts work.
+    # Returns (objective, basis); objective is inf if the LP is infeasible, None if it gave up.
+    basis = list(basis)
+    for _ in range(max_pivots):
+        inverse = np.linalg.inv(matrix[:, basis])
+        values = inverse @ rhs
+        leaving = int(np.argmin(values))
+        if values[leaving] >= -1e-9:
+            return float(costs[basis] @ values), basis
+        row = inverse[leaving] @ matrix
+        reduced = costs - (costs[basis] @ inverse) @ matrix
+        candidates = np.nonzero(row < -1e-9)[0]
+        if candidates.size == 0:
+            return float('inf'), basis
+        ratios = reduced[candidates] / -row[candidates]
+        basis[leaving] = int(candidates[np.argmin(ratios)])
+    return None, basis
+
+
+def make_lp_heuristic(crafting):
+    # Returns the LP bound as a heuristic. Each solve starts from the previous optimal basis, and
+    # search() evaluates the children of one node in a row, so each warm start is a sibling's.
+    # If the solver gives up or the basis goes singular, the default heuristic is used instead.
+    items, matrix, costs, goal = compile_counting_lp(crafting)
+    fallback = make_heuristic(crafting['Goal'])
+    surplus = list(range(matrix.shape[1] - len(items), matrix.shape[1]))
+    last = {'basis': surplus}
+
+    def heuristic(state):
+        rhs = goal - np.array([state[item] for item in items], dtype=float)
+        try:
+            objective, basis = dual_simplex(matrix, costs, rhs, last['basis'])
+        except np.linalg.LinAlgError:
+            objective, basis = None, surplus
+        if objective is None:
+            last['basis'] = surplus
+            return fallback(state)
+        last['basis'] = basis
+        return objective
+
+    return heuristic
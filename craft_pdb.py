@@ -0,0 +1,154 @@
+import json
+import os
+from collections import namedtuple
+from hashlib import sha1
+
+import numpy as np
+
+from craft_planner import recipe_set_hash, relevant_items
+
+PatternDatabase = namedtuple('PatternDatabase', ['items', 'caps', 'strides', 'table'])
+max_pattern_size = 50000
+
+
+def item_caps(crafting):
+    # Largest quantity of each item that any check or the goal can distinguish. Quantities above
+    # it are abstracted to "at least cap".
+    caps = dict((item, max(crafting['Goal'].get(item, 0), 1)) for item in crafting['Items'])
+    for rule in crafting['Recipes'].values():
+        for item, quantity in rule.get('Consumes', {}).items():
+            caps[item] = max(caps[item], quantity)
+    return caps
+
+
+def choose_patterns(crafting, caps, size=max_pattern_size):
+    # Packs the goal-relevant items into disjoint patterns whose abstract state spaces have at most
+    # size states, goal items first so they end up together with their closest ingredients.
+    items, _ = relevant_items(crafting)
+    ordered = [item for item in crafting['Goal'] if item in items] + \
+              [item for item in crafting['Items'] if item in items and item not in crafting['Goal']]
+    patterns = [[]]
+    states = 1
+    for item in ordered:
+        if patterns[-1] and states * (caps[item] + 1) > size:
+            patterns.append([])
+            states = 1
+        patterns[-1].append(item)
+        states *= caps[item] + 1
+    return [pattern for pattern in patterns if pattern]
+
+
+def build_pattern_database(crafting, pattern, caps, owner):
+    # Projects the problem onto the pattern's items and computes the exact abstract cost-to-goal of
+    # every abstract state, by relaxing all abstract recipes backward from the goal states until
+    # nothing changes (a vectorized Bellman-Ford; same distances as backward Dijkstra). A recipe
+    # only costs its Time in the pattern which owns it (see build_pattern_databases), which is what
+    # makes the sum over disjoint patterns admissible. At cap, consuming leaves the quantity at cap:
+    # more items never hurt, so this optimistic choice keeps the abstraction admissible.
+    pattern_caps = np.array([caps[item] for item in pattern], dtype=np.int64)
+    shape = tuple(pattern_caps + 1)
+    strides = np.array([int(np.prod(shape[i + 1:])) for i in range(len(pattern))], dtype=np.int64)
+    values = np.indices(shape).reshape(len(pattern), -1).T
+    goal = np.array([crafting['Goal'].get(item, 0) for item in pattern], dtype=np.int64)
+    distance = np.full(len(values), np.inf)
+    distance[(values >= goal).all(axis=1)] = 0
+    transitions = []
+    for name, rule in crafting['Recipes'].items():
+        need = np.zeros(len(pattern), dtype=np.int64)
+        delta = np.zeros(len(pattern), dtype=np.int64)
+        for i, item in enumerate(pattern):
+            if item in rule.get('Requires', {}):
+                need[i] = 1
+            need[i] = max(need[i], rule.get('Consumes', {}).get(item, 0))
+            delta[i] = rule['Produces'].get(item, 0) - rule.get('Consumes', {}).get(item, 0)
+        if not delta.any():
+            continue
+        applicable = np.nonzero((values >= need).all(axis=1))[0]
+        after = values[applicable] + delta
+        after = np.where(values[applicable] == pattern_caps, pattern_caps, np.minimum(after, pattern_caps))
+        cost = rule['Time'] if owner.get(name) == tuple(pattern) else 0
+        transitions.append((applicable, after @ strides, cost))
+    changed = True
+    while changed:
+        changed = False
+        for applicable, successors, cost in transitions:
+            candidate = distance[successors] + cost
+            improved = candidate < distance[applicable]
+            if improved.any():
+                np.minimum.at(distance, applicable[improved], candidate[improved])
+                changed = True
+    finite = distance[np.isfinite(distance)]
+    dtype = np.uint16 if finite.size == 0 or finite.max() < np.iinfo(np.uint16).max else np.uint32
+    table = np.where(np.isfinite(distance), distance, np.iinfo(dtype).max).astype(dtype)
+    return PatternDatabase(list(pattern), pattern_caps, strides, table)
+
+
+def build_pattern_databases(crafting, patterns, caps):
+    # Each recipe's Time is given to the first pattern containing something it produces, and is
+    # free in the others, so the pattern databases can be added together.
+    owner = {}
+    for name, rule in crafting['Recipes'].items():
+        for pattern in patterns:
+            if any(item in rule['Produces'] for item in pattern):
+                owner[name] = tuple(pattern)
+                break
+    return [build_pattern_database(crafting, pattern, caps, owner) for pattern in patterns]
+
+
+def pdb_file(crafting, directory='.'):
+    # Cached per recipe set and goal.
+    goal = sha1(json.dumps(crafting['Goal'], sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(directory, 'pdb_' + recipe_set_hash(crafting) + '_' + goal + '.npz')
+
+
+def save_pattern_databases(path, pdbs):
+    arrays = {}
+    for i, pdb in enumerate(pdbs):
+        arrays['items_%d' % i] = np.array(pdb.items)
+        arrays['caps_%d' % i] = pdb.caps
+        arrays['strides_%d' % i] = pdb.strides
+        arrays['table_%d' % i] = pdb.table
+    np.savez_compressed(path, **arrays)
+
+
+def load_pattern_databases(path):
+    with np.load(path) as data:
+        count = len([key for key in data.files if key.startswith('table_')])
+        return [PatternDatabase([str(item) for item in data['items_%d' % i]], data['caps_%d' % i],
+                                data['strides_%d' % i], data['table_%d' % i]) for i in range(count)]
+
+
+def get_pattern_databases(crafting, directory='.'):
+    # Loads the pattern databases for this recipe set and goal from disk, building them first if
+    # they aren't cached yet.
+    path = pdb_file(crafting, directory)
+    if os.path.exists(path):
+        return load_pattern_databases(path)
+    caps = item_caps(crafting)
+    pdbs = build_pattern_databases(crafting, choose_patterns(crafting, caps), caps)
+    save_pattern_databases(path, pdbs)
+    return pdbs
+
+
+def make_pdb_heuristic(pdbs):
+    # Returns a heuristic which sums the abstract costs-to-goal of every pattern database; each is
+    # a single table lookup. Unreachable abstract states give infinity.
+    lookups = []
+    for pdb in pdbs:
+        lookups.append((list(zip(pdb.items, pdb.caps.tolist(), pdb.strides.tolist())), pdb.table.tolist(),
+                        np.iinfo(pdb.table.dtype).max))
+
+    def heuristic(state):
+        estimate = 0
+        for pattern, table, unreachable in lookups:
+            index = 0
+            for item, cap, stride in pattern:
+                quantity = state[item]
+                index += (quantity if quantity < cap else cap) * stride
+            value = table[index]
+            if value == unreachable:
+                return float('inf')
+            estimate += value
+        return estimate
+
+    return heuristic
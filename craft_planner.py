@@ -1,13 +1,41 @@
 import json
-from collections import namedtuple, defaultdict, OrderedDict
+import os
+import sys
+import tracemalloc
+from hashlib import sha1
+from collections import namedtuple, defaultdict, deque, OrderedDict
+from math import ceil, exp
 from timeit import default_timer as time
-from heapq import heappop, heappush
+from heapq import heappop, heappush, heapify, nsmallest
 from typing import ItemsView
 from operator import itemgetter
 
+from craft_scheduler import schedule_plan, precedence_graph
+
 Recipe = namedtuple('Recipe', ['name', 'check', 'effect', 'cost', 'heuristic'])
 Ingredient = namedtuple('Ingredient', ['name', 'back_check', 'deffect', 'cost', 'heuristic'])
+Reachability = namedtuple('Reachability', ['solvable', 'unreachable_goals', 'item_levels', 'recipe_levels'])
+Landmarks = namedtuple('Landmarks', ['facts', 'actions', 'orderings', 'goal'])
 exploration_factor = 1500
+use_macros = False
+macro_separator = ' + '
+use_bulk_actions = True
+bulk_separator = ' x '
+crafters = 2
+use_pdb = False
+use_landmarks = False
+use_lp = False
+use_cost_to_go = False  # precompute with python craft_cost_to_go.py
+use_bitstate = False
+search_mode = 'search'  # 'greedy' and 'beam' give up optimality for latency
+beam_width = 50
+max_nodes = None
+memory_limit = None  # bytes; past it search() carries on in bit-state hashing mode
+memory_fallback = True
+track_memory = False
+use_symmetry = False
+heuristic_cache_size = 100000
+trace_file = None  # e.g. 'trace.bin'; analyze with python craft_trace.py trace.bin
 
 
 class State(OrderedDict):
@@ -170,15 +198,81 @@ def make_start_checker(start):
     return is_start
 
 
-def graph(state):
+def graph(state, skip=()):
     # Iterates through all recipes/rules, checking which are valid in the given state.
     # If a rule is valid, it returns the rule's name, the resulting state after application
-    # to the given state, and the cost for the rule.
+    # to the given state, and the cost for the rule. Recipes named in skip are not tried.
     for r in all_recipes:
-        if r.check(state):
+        if r.name not in skip and r.check(state):
             yield (r.name, r.effect(state), r.cost, r.heuristic)
 
 
+def item_demand(crafting, reachability):
+    # Estimates the total number of each item needed to make the goal from nothing, expanding each
+    # item through its earliest reachable (then cheapest) producer. Tools in Requires count once.
+    # Items are expanded from the highest relaxed level down, so a producer's inputs are only
+    # expanded once everything that consumes them has been counted.
+    demand = defaultdict(int)
+    demand.update(crafting['Goal'])
+    levels = reachability.item_levels
+    for item in sorted(levels, key=lambda i: -levels[i]):
+        if demand[item] <= 0 or levels[item] == 0:
+            continue
+        producers = [name for name, rule in crafting['Recipes'].items()
+                     if item in rule['Produces'] and name in reachability.recipe_levels]
+        name = min(producers, key=lambda n: (reachability.recipe_levels[n], crafting['Recipes'][n]['Time']))
+        rule = crafting['Recipes'][name]
+        times = ceil(demand[item] / rule['Produces'][item])
+        for consumable, quantity in rule.get('Consumes', {}).items():
+            demand[consumable] += times * quantity
+        for requirement in rule.get('Requires', {}).keys():
+            demand[requirement] = max(demand[requirement], 1)
+    return dict(demand)
+
+
+def make_bulk_graph(crafting, demand, recipes=None, heuristic=None):
+    # Returns a graph(state) which, besides every single recipe application, applies a recipe k
+    # times in one step, with k chosen so the products cover what is still missing of demand and
+    # limited by what the state can afford. Bulk steps are named e.g. 'craft plank x 5' at a cost
+    # of 5 times the recipe's Time; expand_bulk() turns them back into single steps.
+    # Only the given list of Recipes is tried (all_recipes by default), so a search holding the graph
+    # keeps using the same recipes even if all_recipes is replaced meanwhile; heuristic, when given,
+    # is yielded instead of each recipe's own.
+    recipes = all_recipes if recipes is None else recipes
+    rules = dict((r.name, crafting['Recipes'][r.name]) for r in recipes)
+
+    def bulk_graph(state, skip=()):
+        for r in recipes:
+            if r.name in skip or not r.check(state):
+                continue
+            next_state = r.effect(state)
+            yield (r.name, next_state, r.cost, heuristic or r.heuristic)
+            rule = rules[r.name]
+            k = 0
+            for item, quantity in rule['Produces'].items():
+                k = max(k, ceil((demand.get(item, 0) - state.get(item, 0)) / quantity))
+            for item, quantity in rule.get('Consumes', {}).items():
+                k = min(k, state[item] // quantity)
+            for _ in range(k - 1):
+                next_state = r.effect(next_state)
+            if k > 1:
+                yield (r.name + bulk_separator + str(k), next_state, r.cost * k, heuristic or r.heuristic)
+
+    return bulk_graph
+
+
+def expand_bulk(path):
+    # Expands each bulk step 'name x k' back into k single applications of name.
+    expanded = []
+    for name in path:
+        recipe, _, count = name.rpartition(bulk_separator)
+        if recipe and count.isdigit():
+            expanded.extend([recipe] * int(count))
+        else:
+            expanded.append(name)
+    return expanded
+
+
 def reverse_graph(state):
     # Iterates through all recipes/rules, checking which are valid in the given state.
     # If a rule is valid, it returns the rule's name, the resulting state after application
@@ -190,6 +284,466 @@ def reverse_graph(state):
             yield (i.name, i.deffect(state), i.cost, i.heuristic)
 
 
+def relevant_items(crafting):
+    # Walks backward from the goal items through each recipe's Produces/Consumes/Requires and
+    # returns the set of items and the set of recipe names that can contribute to the goal.
+    items = set(crafting['Goal'].keys())
+    recipes = set()
+    frontier = list(items)
+    while frontier:
+        item = frontier.pop()
+        for name, rule in crafting['Recipes'].items():
+            if name in recipes or item not in rule['Produces']:
+                continue
+            recipes.add(name)
+            for needed in list(rule.get('Consumes', {}).keys()) + list(rule.get('Requires', {}).keys()):
+                if needed not in items:
+                    items.add(needed)
+                    frontier.append(needed)
+    return items, recipes
+
+
+def prune_irrelevant(crafting):
+    # Returns a copy of crafting restricted to the goal-relevant items and recipes, along with a
+    # report of what was removed. By-products of relevant recipes which are themselves irrelevant
+    # are dropped from Produces, since nothing relevant ever consumes or requires them.
+    items, recipes = relevant_items(crafting)
+    pruned = dict(crafting)
+    pruned['Items'] = [item for item in crafting['Items'] if item in items]
+    pruned['Initial'] = {item: quantity for item, quantity in crafting['Initial'].items() if item in items}
+    pruned['Recipes'] = {}
+    for name, rule in crafting['Recipes'].items():
+        if name not in recipes:
+            continue
+        rule = dict(rule)
+        rule['Produces'] = {item: quantity for item, quantity in rule['Produces'].items() if item in items}
+        pruned['Recipes'][name] = rule
+    report = {
+        'removed_items': [item for item in crafting['Items'] if item not in items],
+        'removed_recipes': [name for name in crafting['Recipes'] if name not in recipes],
+        'items': (len(crafting['Items']), len(pruned['Items'])),
+        'recipes': (len(crafting['Recipes']), len(pruned['Recipes'])),
+    }
+    return pruned, report
+
+
+def print_pruning_report(report):
+    print("Removed items: " + ", ".join(report['removed_items']))
+    print("Removed recipes: " + ", ".join(report['removed_recipes']))
+    print("Items: %d -> %d, recipes: %d -> %d" % (report['items'] + report['recipes']))
+    if report['recipes'][1] > 0:
+        # graph() checks every recipe on each expansion, so this many times fewer checks are made
+        # per expansion; it is a count, not a measured speedup.
+        print("Recipe checks per expansion: %.2fx fewer" % (report['recipes'][0] / report['recipes'][1]))
+
+
+def make_commutativity(crafting):
+    # Two recipes commute when neither consumes anything the other consumes or requires, and
+    # neither produces anything the other consumes or requires. Applying them in either order
+    # is then possible from the same states and reaches the same state at the same cost, so only
+    # one order needs to be searched. Returns, for each recipe, the recipes which commute with
+    # it and come earlier in Crafting['Recipes']; search() skips those right after it.
+    rules = list(crafting['Recipes'].items())
+    needs = {}
+    for name, rule in rules:
+        needs[name] = set(rule.get('Consumes', {}).keys()) | set(rule.get('Requires', {}).keys())
+
+    def commute(a, b):
+        consumes_a = set(crafting['Recipes'][a].get('Consumes', {}).keys())
+        consumes_b = set(crafting['Recipes'][b].get('Consumes', {}).keys())
+        produces_a = set(crafting['Recipes'][a]['Produces'].keys())
+        produces_b = set(crafting['Recipes'][b]['Produces'].keys())
+        return not (consumes_a & needs[b] or consumes_b & needs[a] or
+                    produces_a & needs[b] or produces_b & needs[a])
+
+    pruned_after = {}
+    for index, (name, rule) in enumerate(rules):
+        pruned_after[name] = frozenset(other for other, _ in rules[:index] if commute(name, other))
+    return pruned_after
+
+
+def make_macro_rule(crafting, steps):
+    # Composes a sequence of recipe names into a single rule with the same Consumes/Requires/
+    # Produces semantics as the sequence. Returns None when the sequence can't be written as one
+    # rule exactly, e.g. when a later step requires an item that an earlier step consumes.
+    net = defaultdict(int)
+    need = defaultdict(int)
+    required = set()
+    for name in steps:
+        rule = crafting['Recipes'][name]
+        consumes = rule.get('Consumes', {})
+        for item in set(consumes.keys()) | set(rule.get('Requires', {}).keys()):
+            threshold = max(consumes.get(item, 0), 1 if item in rule.get('Requires', {}) else 0)
+            need[item] = max(need[item], net[item] + threshold)
+            if item in rule.get('Requires', {}):
+                required.add(item)
+        for item, quantity in consumes.items():
+            net[item] += quantity
+        for item, quantity in rule['Produces'].items():
+            net[item] -= quantity
+    macro = {'Produces': {}, 'Consumes': {}, 'Requires': {},
+             'Time': sum(crafting['Recipes'][name]['Time'] for name in steps)}
+    for item in list(need.keys()) + list(net.keys()):
+        if net[item] > 0:
+            macro['Consumes'][item] = net[item]
+        if need[item] > max(net[item], 0):
+            if need[item] > 1 or item not in required:
+                return None
+            macro['Requires'][item] = True
+    macro['Produces'] = {item: -quantity for item, quantity in net.items() if quantity < 0}
+    if not macro['Produces']:
+        return None
+    for key in ('Consumes', 'Requires'):
+        if not macro[key]:
+            del macro[key]
+    return macro
+
+
+def chain_macros(crafting):
+    # Derives macros statically: when an item is consumed by exactly one recipe, every recipe
+    # which produces it is chained with that consumer, e.g. punch for wood + craft plank.
+    consumers = defaultdict(list)
+    for name, rule in crafting['Recipes'].items():
+        for item in rule.get('Consumes', {}).keys():
+            consumers[item].append(name)
+    macros = {}
+    for item, names in consumers.items():
+        if len(names) != 1:
+            continue
+        for name, rule in crafting['Recipes'].items():
+            if item in rule['Produces'] and name != names[0]:
+                steps = [name, names[0]]
+                macros[macro_separator.join(steps)] = steps
+    return macros
+
+
+def mine_macros(crafting, plans, min_count=2, length=2):
+    # Mines macros from solved plans: every run of length consecutive recipes which occurs at
+    # least min_count times across the plans becomes a macro.
+    counts = defaultdict(int)
+    for plan in plans:
+        for index in range(len(plan) - length + 1):
+            counts[tuple(plan[index:index + length])] += 1
+    return {macro_separator.join(steps): list(steps) for steps, count in counts.items()
+            if count >= min_count and all(step in crafting['Recipes'] for step in steps)}
+
+
+def add_macros(crafting, macros):
+    # Returns a copy of crafting with each macro that can be composed exactly added as a recipe.
+    extended = dict(crafting)
+    extended['Recipes'] = dict(crafting['Recipes'])
+    for name, steps in macros.items():
+        rule = make_macro_rule(crafting, steps)
+        if rule is not None:
+            extended['Recipes'][name] = rule
+    return extended
+
+
+def expand_macros(path, macros):
+    # Replaces every macro in a plan with the primitive recipes it stands for.
+    expanded = []
+    for name in path:
+        if name in macros:
+            expanded.extend(expand_macros(macros[name], macros))
+        else:
+            expanded.append(name)
+    return expanded
+
+
+def recipe_set_hash(crafting):
+    return sha1(json.dumps(crafting['Recipes'], sort_keys=True).encode()).hexdigest()[:16]
+
+
+def macro_file(crafting, directory='.'):
+    # Macros are stored per recipe set, keyed by a hash of Crafting['Recipes'].
+    return os.path.join(directory, 'macros_' + recipe_set_hash(crafting) + '.json')
+
+
+def load_macros(crafting, directory='.'):
+    try:
+        with open(macro_file(crafting, directory)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_macros(crafting, macros, directory='.'):
+    with open(macro_file(crafting, directory), 'w') as f:
+        json.dump(macros, f, indent=1, sort_keys=True)
+
+
+def check_reachability(crafting):
+    # Relaxed reachability: ignores quantities and the fact that consumed items go away, so an item
+    # which is unreachable here can never be produced. Runs a fixpoint over Requires/Consumes/Produces
+    # layer by layer; item_levels and recipe_levels record the first layer each becomes available,
+    # which heuristics can use as a cheap admissible estimate of how far away an item is.
+    item_levels = {item: 0 for item, quantity in crafting['Initial'].items() if quantity > 0}
+    recipe_levels = {}
+    level = 0
+    changed = True
+    while changed:
+        changed = False
+        level += 1
+        new_items = {}
+        for name, rule in crafting['Recipes'].items():
+            if name in recipe_levels:
+                continue
+            needed = list(rule.get('Requires', {}).keys()) + list(rule.get('Consumes', {}).keys())
+            if all(item in item_levels for item in needed):
+                recipe_levels[name] = level - 1
+                changed = True
+                for product in rule['Produces'].keys():
+                    if product not in item_levels:
+                        new_items[product] = level
+        item_levels.update(new_items)
+    unreachable_goals = [item for item, quantity in crafting['Goal'].items()
+                         if quantity > 0 and item not in item_levels]
+    return Reachability(not unreachable_goals, unreachable_goals, item_levels, recipe_levels)
+
+
+class CostTable:
+    """ A lower bound on the Time needed to obtain each item from nothing, and the single recipe
+        cheapest for one unit of it. The bound has two parts. unit is the marginal cost of one more unit: a recipe's Time
+        plus the unit cost of everything it consumes, divided by how many of the item it makes.
+        setup is paid once however many units are made: the dearest tool any step of the
+        derivation requires. Tools only have to be made once, so charging one per unit would
+        overcount; taking the dearest rather than the sum keeps tools which share ingredients
+        (two that both need a bench, say) from being counted twice. Making n units takes at
+        least n * unit + setup, the two minimized over the recipes separately, so the bound can
+        be below what the best recipe alone costs.
+        Costs are found by a label-correcting fixpoint over the AND/OR recipe graph. When a
+        recipe is added or gets cheaper, only the items downstream of it are relaxed; when one is
+        removed or gets dearer, only the items whose bound came from it are reset and recomputed.
+    """
+
+    def __init__(self, crafting, saved=None):
+        self.recipes = {}
+        self.producers = defaultdict(set)
+        self.users = defaultdict(set)
+        self.unit = {}
+        self.setup = {}
+        self.cost = {}
+        self.best = {}
+        # The recipes each item's unit, setup and best come from, for invalidation.
+        self.basis = {}
+        # Number of item evaluations done, to see how much an edit had to recompute.
+        self.recomputed = 0
+        for name, rule in crafting['Recipes'].items():
+            self.register(name, rule)
+        # A table saved with to_dict for the same recipe set is restored instead of recomputed.
+        if saved is not None and saved.get('recipes') == recipe_set_hash(crafting) and 'basis' in saved:
+            self.unit = dict(saved['unit'])
+            self.setup = dict(saved['setup'])
+            self.cost = dict((item, self.unit[item] + self.setup[item]) for item in self.unit if item in self.setup)
+            self.best = dict(saved['best'])
+            self.basis = dict((item, set(names)) for item, names in saved['basis'].items())
+        else:
+            self.relax(list(self.producers.keys()))
+
+    def register(self, name, rule):
+        self.recipes[name] = rule
+        for item in rule['Produces'].keys():
+            self.producers[item].add(name)
+        for item in list(rule.get('Consumes', {}).keys()) + list(rule.get('Requires', {}).keys()):
+            self.users[item].add(name)
+
+    def unregister(self, name):
+        rule = self.recipes.pop(name)
+        for item in rule['Produces'].keys():
+            self.producers[item].discard(name)
+        for item in list(rule.get('Consumes', {}).keys()) + list(rule.get('Requires', {}).keys()):
+            self.users[item].discard(name)
+
+    def recipe_cost(self, name, item):
+        # Returns (unit, setup) for item made by the recipe.
+        rule = self.recipes[name]
+        unit = rule['Time']
+        setup = 0
+        for consumable, quantity in rule.get('Consumes', {}).items():
+            unit += quantity * self.unit.get(consumable, float('inf'))
+            setup = max(setup, self.setup.get(consumable, float('inf')))
+        for requirement in rule.get('Requires', {}).keys():
+            setup = max(setup, self.cost.get(requirement, float('inf')))
+        return unit / rule['Produces'][item], setup
+
+    def relax(self, items):
+        # Re-evaluates the given items, pushing any item whose bound drops on to everything made
+        # from it. The tolerance stops cycles of multiplying recipes converging forever.
+        worklist = deque(items)
+        pending = set(worklist)
+        while worklist:
+            item = worklist.popleft()
+            pending.discard(item)
+            self.recomputed += 1
+            improved = False
+            cheapest, best = float('inf'), None
+            for name in self.producers[item]:
+                unit, setup = self.recipe_cost(name, item)
+                basis = self.basis.setdefault(item, set())
+                if unit < self.unit.get(item, float('inf')) - 1e-9:
+                    self.unit[item] = unit
+                    basis.add(name)
+                    improved = True
+                if setup < self.setup.get(item, float('inf')) - 1e-9:
+                    self.setup[item] = setup
+                    basis.add(name)
+                    improved = True
+                if unit + setup < cheapest - 1e-9:
+                    cheapest, best = unit + setup, name
+            if best is not None and best != self.best.get(item):
+                self.best[item] = best
+                self.basis.setdefault(item, set()).add(best)
+            if improved:
+                self.cost[item] = self.unit.get(item, float('inf')) + self.setup.get(item, float('inf'))
+                for user in self.users[item]:
+                    for product in self.recipes[user]['Produces'].keys():
+                        if product not in pending:
+                            pending.add(product)
+                            worklist.append(product)
+
+    def invalidate(self, items):
+        # Resets the given items and everything whose bound came from a recipe using one of them,
+        # then recomputes just those.
+        stale = set(items)
+        changed = True
+        while changed:
+            changed = False
+            for item, names in self.basis.items():
+                if item in stale:
+                    continue
+                for name in names:
+                    rule = self.recipes.get(name)
+                    needed = set(rule.get('Consumes', {}).keys()) | set(rule.get('Requires', {}).keys()) \
+                        if rule is not None else set()
+                    if rule is None or needed & stale:
+                        stale.add(item)
+                        changed = True
+                        break
+        for item in stale:
+            for table in (self.unit, self.setup, self.cost, self.best, self.basis):
+                table.pop(item, None)
+        self.relax(stale)
+
+    def add_recipe(self, name, rule):
+        self.register(name, rule)
+        self.relax(rule['Produces'].keys())
+
+    def remove_recipe(self, name):
+        self.unregister(name)
+        self.invalidate(item for item, names in self.basis.items() if name in names)
+
+    def set_time(self, name, time_cost):
+        old_time = self.recipes[name]['Time']
+        self.recipes[name] = dict(self.recipes[name], Time=time_cost)
+        if time_cost < old_time:
+            self.relax(self.recipes[name]['Produces'].keys())
+        else:
+            self.invalidate(item for item, names in self.basis.items() if name in names)
+
+    def copy(self):
+        # An independent table, so one can be edited while the other stays in use.
+        table = CostTable.__new__(CostTable)
+        table.recipes = dict(self.recipes)
+        table.producers = defaultdict(set, ((item, set(names)) for item, names in self.producers.items()))
+        table.users = defaultdict(set, ((item, set(names)) for item, names in self.users.items()))
+        table.unit = dict(self.unit)
+        table.setup = dict(self.setup)
+        table.cost = dict(self.cost)
+        table.best = dict(self.best)
+        table.basis = dict((item, set(names)) for item, names in self.basis.items())
+        table.recomputed = self.recomputed
+        return table
+
+    def query(self, item, quantity=1):
+        # Returns (lower bound on the Time to make quantity of item, best recipe for one unit), or
+        # (inf, None) if it can't be made.
+        cost = quantity * self.unit.get(item, float('inf')) + self.setup.get(item, float('inf'))
+        return cost, self.best.get(item) if cost < float('inf') else None
+
+    def to_dict(self):
+        # JSON-ready; pass it back as CostTable(crafting, saved) to skip the fixpoint.
+        crafting = {'Recipes': self.recipes}
+        return {'recipes': recipe_set_hash(crafting), 'unit': self.unit, 'setup': self.setup, 'best': self.best,
+                'basis': dict((item, sorted(names)) for item, names in self.basis.items())}
+
+
+def find_landmarks(crafting):
+    # Fact landmarks are items every plan has to obtain at some point: the goal items, and any item
+    # not in the initial inventory without whose producers the goal is unreachable in the relaxed
+    # problem. The same test with a landmark as the goal gives orderings: orderings[q] holds the
+    # landmarks which have to be obtained before q. Action landmarks are recipes which are the
+    # only way to make some fact landmark.
+    def without(items):
+        restricted = dict(crafting)
+        restricted['Recipes'] = dict((name, rule) for name, rule in crafting['Recipes'].items()
+                                     if not any(item in rule['Produces'] for item in items))
+        return restricted
+
+    facts = [item for item in crafting['Items'] if item in crafting['Goal'] or
+             (crafting['Initial'].get(item, 0) <= 0 and not check_reachability(without([item])).solvable)]
+    orderings = {}
+    for later in facts:
+        orderings[later] = frozenset(earlier for earlier in facts if earlier != later and
+                                     not check_reachability(dict(without([earlier]), Goal={later: 1})).solvable)
+    actions = []
+    for item in facts:
+        achievers = [name for name, rule in crafting['Recipes'].items() if item in rule['Produces']]
+        if len(achievers) == 1 and achievers[0] not in actions:
+            actions.append(achievers[0])
+    return Landmarks(facts, actions, orderings, dict(crafting['Goal']))
+
+
+def landmarks_reached(landmarks, state, reached):
+    # A landmark counts as reached once it holds in some state along the path after all the
+    # landmarks ordered before it were reached; reached is the parent node's set.
+    new = [item for item in landmarks.facts if item not in reached and state[item] > 0 and
+           landmarks.orderings[item] <= reached]
+    if not new:
+        return reached
+    return reached | frozenset(new)
+
+
+def landmark_count(landmarks, state, reached):
+    # LAMA's landmark-count heuristic: landmarks not reached yet, plus reached ones needed again,
+    # i.e. goals not currently held and landmarks not held which an unreached landmark is ordered
+    # after.
+    count = len(landmarks.facts) - len(reached)
+    for item in reached:
+        if item in landmarks.goal and state[item] < landmarks.goal[item]:
+            count += 1
+        elif state[item] <= 0 and any(item in landmarks.orderings[other]
+                                      for other in landmarks.facts if other not in reached):
+            count += 1
+    return count
+
+
+def make_landmark_heuristic(landmarks):
+    # Stateless landmark count for engines which don't track a path, e.g. bidirecitonal_search.
+    # A landmark is taken as reached if it is held now or a landmark ordered after it is held.
+    def heuristic(state):
+        held = set(item for item in landmarks.facts if state[item] > 0)
+        reached = set(held)
+        for item in held:
+            reached.update(landmarks.orderings[item])
+        return landmark_count(landmarks, state, frozenset(reached))
+
+    return heuristic
+
+
+def make_back_landmark_heuristic(landmarks):
+    # For backsearch(): the landmarks a regressed state still has to be unwound through, i.e. the
+    # landmarks it holds together with those ordered before them.
+    def back_heuristic(state):
+        remaining = set()
+        for item in landmarks.facts:
+            if state[item] > 0:
+                remaining.add(item)
+                remaining.update(landmarks.orderings[item])
+        return len(remaining)
+
+    return back_heuristic
+
+
 def make_heuristic(goal):
     def heuristic(state):
         # This heuristic function should guide your search.
@@ -208,6 +762,45 @@ def make_heuristic(goal):
     return heuristic
 
 
+class HeuristicCache:
+    """ Wraps a heuristic in a bounded least-recently-used cache of its values by state, and counts
+        hits and misses. One is shared by every rule of a run, so a state's estimate is computed
+        once however many recipes lead to it, and stays cached across searches with the same goal.
+        The wrapped heuristic must not depend on how the state was reached.
+    """
+
+    def __init__(self, heuristic, size=None):
+        self.heuristic = heuristic
+        self.size = heuristic_cache_size if size is None else size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, state):
+        values = self.values
+        if state in values:
+            self.hits += 1
+            values.move_to_end(state)
+            return values[state]
+        self.misses += 1
+        value = values[state] = self.heuristic(state)
+        if len(values) > self.size:
+            values.popitem(last=False)
+        return value
+
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    def clear(self):
+        self.values.clear()
+
+
+def print_heuristic_cache_report(cache):
+    print("Heuristic cache: " + str(cache.hits) + " hits, " + str(cache.misses) + " misses (" +
+          "%.1f%%" % (100 * cache.hit_rate()) + " hit rate), " + str(len(cache.values)) + " entries")
+
+
 def make_back_heuristic(start, rule):
     def back_heuristic(state):
         # This heuristic function should guide your search.
@@ -226,22 +819,312 @@ def make_back_heuristic(start, rule):
     return back_heuristic
 
 
+def build_rules(crafting, heuristic=None, back_heuristic=None):
+    # Compiles every recipe in crafting into a Recipe (forward) and an Ingredient (backward).
+    # Every Recipe shares one heuristic, make_heuristic(goal) by default, and every Ingredient one
+    # back_heuristic, make_heuristic(initial) by default; pass heuristic or back_heuristic to use
+    # others instead, e.g. wrapped in a HeuristicCache.
+    all_recipes = []
+    all_ingredients = []
+    if heuristic is None:
+        heuristic = make_heuristic(crafting['Goal'])
+    if back_heuristic is None:
+        back_heuristic = make_heuristic(crafting['Initial'])
+    for name, rule in crafting['Recipes'].items():
+        checker = make_checker(rule)
+        effector = make_effector(rule)
+        back_checker = make_back_checker(rule)
+        deffector = make_deffector(rule)
+        recipe = Recipe(name, checker, effector, rule['Time'], heuristic)
+        ingredient = None
+        for product, quantity in rule["Produces"].items():
+            ingredient = Ingredient(name, back_checker, deffector, rule['Time'], back_heuristic)
+        all_recipes.append(recipe)
+        all_ingredients.append(ingredient)
+    return all_recipes, all_ingredients
+
+
+def simulate_plan(plan, state, recipes):
+    # Replays a plan with the compiled rules; returns the final state, or None if a step can't run.
+    for name in plan:
+        if not recipes[name].check(state):
+            return None
+        state = recipes[name].effect(state)
+    return state
+
+
+def optimize_plan(crafting, plan, state, is_goal, recipes):
+    # Post-processes a plan: drops steps nothing later depends on (outputs never consumed or
+    # required, duplicate tools) and swaps steps for cheaper recipes making the same items,
+    # keeping each change only if the whole plan still runs and reaches the goal.
+    # Returns the new plan and the in-game Time saved.
+    def valid(candidate):
+        final_state = simulate_plan(candidate, state, recipes)
+        return final_state is not None and is_goal(final_state)
+
+    def cost(candidate):
+        return sum(crafting['Recipes'][name]['Time'] for name in candidate)
+
+    original_cost = cost(plan)
+    plan = list(plan)
+    initial = dict((item, quantity) for item, quantity in state.items() if quantity > 0)
+    changed = True
+    while changed:
+        changed = False
+        predecessors, _ = precedence_graph(crafting, plan, initial)
+        used = set()
+        for before in predecessors:
+            used.update(before)
+        for index in reversed(range(len(plan))):
+            if index not in used and valid(plan[:index] + plan[index + 1:]):
+                del plan[index]
+                changed = True
+                break
+        if changed:
+            continue
+        for index, name in enumerate(plan):
+            produces = set(crafting['Recipes'][name]['Produces'].keys())
+            for other, rule in crafting['Recipes'].items():
+                if other in recipes and rule['Time'] < crafting['Recipes'][name]['Time'] and \
+                        produces <= set(rule['Produces'].keys()):
+                    candidate = plan[:index] + [other] + plan[index + 1:]
+                    if valid(candidate):
+                        plan = candidate
+                        changed = True
+                        break
+            if changed:
+                break
+    return plan, original_cost - cost(plan)
+
+
 # Search
-def search(graph, state, is_goal, limit):
-    start_time = time()
+class SearchControl:
+    """ Budgets and cancellation shared by the search engines. An engine calls keep_going() once
+        per expansion; the node budget and the estimated memory budget are checked every time, but
+        the clock, the cancellation token, measured memory and the progress callback only every
+        check_every expansions.
+        cancelled is anything with an is_set() method (a threading.Event, or a multiprocessing
+        Event to stop a search in another process). progress is called as
+        progress(expansions, nodes, elapsed seconds). Once keep_going() returns False, stopped
+        says why: 'time', 'nodes', 'memory' or 'cancelled'.
+
+        Memory is the number of live nodes the engine reports times an estimated size per node,
+        or, with track_memory, what tracemalloc measures was allocated since the search started
+        (more exact, but it slows every allocation down). The peaks are kept in peak_nodes and
+        peak_bytes; call finish() once the search is over.
+    """
+
+    def __init__(self, limit=None, max_nodes=None, max_bytes=None, cancelled=None, progress=None,
+                 check_every=256, track_memory=False):
+        self.limit = limit
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.cancelled = cancelled
+        self.progress = progress
+        self.check_every = check_every
+        self.track_memory = track_memory
+        self.tracing = False
+        self.start(None)
+
+    def start(self, state):
+        # Resets the counters; state is a sample node used to estimate the bytes per node.
+        self.start_time = time()
+        self.expansions = 0
+        self.countdown = 0
+        self.stopped = None
+        self.node_bytes = node_size(state) if state is not None else 0
+        self.peak_nodes = 0
+        self.peak_bytes = 0
+        if self.track_memory and state is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            tracemalloc.reset_peak()
+            self.base_bytes = tracemalloc.get_traced_memory()[0]
+
+    def memory_bytes(self, nodes):
+        if self.track_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0] - self.base_bytes
+        return nodes * self.node_bytes
+
+    def finish(self):
+        # Settles peak_bytes, and stops tracemalloc if start() started it.
+        if not self.track_memory:
+            self.peak_bytes = max(self.peak_bytes, self.peak_nodes * self.node_bytes)
+        elif tracemalloc.is_tracing():
+            self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1] - self.base_bytes)
+            if self.tracing:
+                tracemalloc.stop()
+                self.tracing = False
+
+    def elapsed(self):
+        return time() - self.start_time
+
+    def keep_going(self, nodes):
+        self.expansions += 1
+        if nodes > self.peak_nodes:
+            self.peak_nodes = nodes
+        if self.max_nodes is not None and nodes >= self.max_nodes:
+            self.stopped = 'nodes'
+            return False
+        if self.max_bytes is not None and not self.track_memory and \
+                nodes * self.node_bytes > self.max_bytes:
+            self.stopped = 'memory'
+            return False
+        self.countdown -= 1
+        if self.countdown > 0:
+            return True
+        self.countdown = self.check_every
+        elapsed = self.elapsed()
+        memory = self.memory_bytes(nodes)
+        self.peak_bytes = max(self.peak_bytes, memory)
+        if self.limit is not None and elapsed >= self.limit:
+            self.stopped = 'time'
+        elif self.cancelled is not None and self.cancelled.is_set():
+            self.stopped = 'cancelled'
+        elif self.max_bytes is not None and memory > self.max_bytes:
+            self.stopped = 'memory'
+        if self.progress is not None:
+            self.progress(self.expansions, nodes, elapsed)
+        return self.stopped is None
+
+    def failure(self):
+        return {'time': 'within time limit.', 'nodes': 'within the node budget.',
+                'memory': 'within the memory budget.', 'cancelled': 'before being cancelled.'}.get(
+            self.stopped, 'within time limit.')
+
+
+def print_memory_report(control):
+    print("Peak memory: " + "%.1f" % (control.peak_bytes / 2 ** 20) + " MB" +
+          (" (measured)" if control.track_memory else " (estimated)") + ", " + str(control.peak_nodes) +
+          " live nodes")
+
+
+def node_size(state):
+    # Rough bytes a stored node costs: the state, its parent entry, and a slot in each of the
+    # times and previous_recipe dicts and the queue.
+    return sys.getsizeof(state) + sys.getsizeof((None, state)) + 3 * 64
+
+
+class BitStateTable:
+    """ Approximate visited set for bit-state hashing: a Bloom filter of bits bits with hashes
+        probes per state. A state never added may be reported as seen (and then never explored),
+        so searches using it trade completeness for using a fixed, small amount of memory.
+    """
+
+    def __init__(self, bits=2 ** 23, hashes=3):
+        self.bits = bits
+        self.hashes = hashes
+        self.table = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    def add(self, state):
+        # Marks state as visited; returns True if it (probably) already was.
+        h1 = hash(state) & 0xFFFFFFFFFFFFFFFF
+        h2 = hash((h1, 0x9E3779B97F4A7C15)) | 1
+        seen = True
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.bits
+            if not self.table[bit >> 3] & (1 << (bit & 7)):
+                seen = False
+                self.table[bit >> 3] |= 1 << (bit & 7)
+        if not seen:
+            self.count += 1
+        return seen
+
+    def omission_probability(self):
+        # Chance that a new state is wrongly reported as seen, given how full the table is.
+        return (1 - exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def memory_bytes(self):
+        return len(self.table)
+
+
+def bitstate_search(graph, state, is_goal, limit, bitstate, forward=True, pruned_after=None, control=None,
+                    max_queue=None):
+    # search() with the times dict replaced by a BitStateTable. Duplicates are dropped on sight
+    # and never reopened. Instead of a parent map over every visited state, each open node carries
+    # its own chain of recipe names as a linked list (name, parent chain), shared with its
+    # siblings, so only the chains of nodes still in the queue are kept alive. With max_queue, the
+    # queue is cut back to its best half whenever it grows past that, which bounds memory at the
+    # cost of completeness, like a beam.
+    control = control or SearchControl(limit)
+    control.start(state)
+    bitstate.add(state)
+    queue = [(0, state, None)]
+    known_recipes = {}
+    while queue and control.keep_going(len(queue)):
+        current_game_time, current_state, chain = heappop(queue)
+        if is_goal(current_state):
+            path = []
+            while chain is not None:
+                path.append(chain[0])
+                chain = chain[1]
+            return (path[::-1] if forward else path, control.elapsed(), bitstate.count)
+        if pruned_after:
+            successors = graph(current_state, pruned_after.get(chain[0] if chain else None, ()))
+        else:
+            successors = graph(current_state)
+        for name, resulting_state, time_cost, heuristic in successors:
+            if bitstate.add(resulting_state):
+                continue
+            new_time = current_game_time + heuristic(resulting_state)
+            if name not in known_recipes:
+                known_recipes[name] = 0
+                new_time /= exploration_factor
+            heappush(queue, (new_time, resulting_state, (name, chain)))
+        if max_queue is not None and len(queue) > max_queue:
+            queue = nsmallest(max_queue // 2, queue)
+            heapify(queue)
+
+    print("Failed to find a path from", state, control.failure())
+    return None
+
+
+def print_bitstate_report(bitstate):
+    print("Bit-state table: " + str(bitstate.memory_bytes()) + " bytes, " + str(bitstate.count) +
+          " states, estimated omission probability " + "%.2e" % bitstate.omission_probability())
+
+
+def search(graph, state, is_goal, limit, pruned_after=None, landmarks=None, bitstate=None, control=None,
+           trace=None):
+    # pruned_after is the table from make_commutativity(); when given, only one canonical order
+    # of each pair of commuting recipes is generated. landmarks is the result of find_landmarks();
+    # when given, the landmark count tracked along each path replaces the recipes' heuristic.
+    # bitstate is a BitStateTable; when given, the search runs in bit-state hashing mode.
+    # control is a SearchControl; when given, its budgets and cancellation replace limit.
+    # trace is a craft_trace.TraceRecorder; when given, every expansion is recorded to it.
+    # If control's memory budget runs out and memory_fallback is set, the states stored so far are
+    # dropped and the search starts over in bit-state hashing mode, with a visited set taking a
+    # quarter of the budget and a queue cut back whenever it would outgrow the rest.
+    # Without landmarks, times holds the priority each state was reached from rather than its own:
+    # the heuristic doesn't depend on the path, so comparing those is the same test, and the
+    # heuristic is only evaluated for states which pass it.
+    if bitstate is not None:
+        return bitstate_search(graph, state, is_goal, limit, bitstate, True, pruned_after, control)
+    control = control or SearchControl(limit)
     initial_state = state.copy()
+    control.start(initial_state)
     times = {initial_state: 0}
     previous_recipe = {initial_state: (None, None)}
+    if trace is not None:
+        trace.start(initial_state)
+    if landmarks:
+        reached = {initial_state: landmarks_reached(landmarks, initial_state, frozenset())}
     queue = [(0, initial_state)]
     known_recipes = {}
     current_state = None
 
     # Search
-    while time() - start_time < limit and queue:
+    while queue and control.keep_going(len(times)):
         current_game_time, current_state = heappop(queue)
         # print("cur " + str(current_state))
+        if trace is not None:
+            trace.expanded(current_state, current_game_time)
         if is_goal(current_state):
             # print (current_game_time)
+            if trace is not None:
+                trace.goal(current_state, current_game_time)
             node = None
             if previous_recipe[current_state] is not None:
                 node = current_state
@@ -250,18 +1133,33 @@ def search(graph, state, is_goal, limit):
                 path.append(previous_recipe[node][0])
                 node = previous_recipe[node][1]
                 # print(previous_recipe[node][0])
-            total_time = time() - start_time
+            total_time = control.elapsed()
             return (path[::-1], total_time, len(times))
-        for name, resulting_state, time_cost, heuristic in graph(current_state):
-            new_time = current_game_time + heuristic(resulting_state)
+        if pruned_after:
+            successors = graph(current_state, pruned_after.get(previous_recipe[current_state][0], ()))
+        else:
+            successors = graph(current_state)
+        for name, resulting_state, time_cost, heuristic in successors:
+            if landmarks:
+                child_reached = landmarks_reached(landmarks, resulting_state, reached[current_state])
+                estimate = landmark_count(landmarks, resulting_state, child_reached)
+                reached_from = current_game_time + estimate
+            else:
+                reached_from = current_game_time
             # print("go " + name)
             # print(resulting_state)
             # if resulting_state in times:
             # print("res " + str(times[resulting_state]))
-            # print(new_time)
-            if resulting_state not in times or new_time < times[resulting_state]:
-                times[resulting_state] = new_time
+            if resulting_state not in times or reached_from < times[resulting_state]:
+                if not landmarks:
+                    estimate = heuristic(resulting_state)
+                new_time = current_game_time + estimate
+                times[resulting_state] = reached_from
                 previous_recipe[resulting_state] = (name, current_state)
+                if landmarks:
+                    reached[resulting_state] = child_reached
+                if trace is not None:
+                    trace.generated(resulting_state, current_state, name, time_cost, estimate)
                 # print("he " + name)
                 if name not in known_recipes:
                     known_recipes[name] = 0
@@ -269,16 +1167,150 @@ def search(graph, state, is_goal, limit):
                     new_time /= exploration_factor
                 heappush(queue, (new_time, resulting_state))
 
+    if control.stopped == 'memory' and memory_fallback:
+        print("Memory budget reached with", len(times), "states stored; continuing in bit-state hashing mode.")
+        times = previous_recipe = queue = reached = None
+        remaining = None if control.limit is None else control.limit - control.elapsed()
+        fallback = SearchControl(remaining, control.max_nodes, None, control.cancelled, control.progress,
+                                 control.check_every, control.track_memory)
+        bitstate = BitStateTable(control.max_bytes * 2)
+        results = bitstate_search(graph, state, is_goal, remaining, bitstate, True, pruned_after, fallback,
+                                  control.max_bytes * 3 // 4 // control.node_bytes)
+        fallback.finish()
+        control.stopped = fallback.stopped
+        control.peak_nodes = max(control.peak_nodes, fallback.peak_nodes)
+        control.peak_bytes = max(control.peak_bytes, fallback.peak_bytes + bitstate.memory_bytes())
+        return results
+
     # Failed to find a path
     # print(time() - start_time)
-    print("Failed to find a path from", state, 'within time limit.')
+    print("Failed to find a path from", state, control.failure())
+    return None
+
+
+def greedy_search(graph, state, is_goal, limit, max_nodes=None, control=None):
+    # Greedy best-first search: always expands the open state with the lowest heuristic value,
+    # ignoring cost so far. Stops after limit seconds or once max_nodes states have been stored,
+    # or as control says when one is given.
+    # Returns (path, computation time, number of states, optimal); plans are never guaranteed
+    # optimal.
+    control = control or SearchControl(limit, max_nodes)
+    initial_state = state.copy()
+    control.start(initial_state)
+    previous_recipe = {initial_state: (None, None)}
+    queue = [(0, initial_state)]
+    while queue and control.keep_going(len(previous_recipe)):
+        _, current_state = heappop(queue)
+        if is_goal(current_state):
+            node = current_state
+            path = []
+            while previous_recipe[node][0] is not None:
+                path.append(previous_recipe[node][0])
+                node = previous_recipe[node][1]
+            return (path[::-1], control.elapsed(), len(previous_recipe), False)
+        for name, resulting_state, time_cost, heuristic in graph(current_state):
+            if resulting_state not in previous_recipe:
+                previous_recipe[resulting_state] = (name, current_state)
+                heappush(queue, (heuristic(resulting_state), resulting_state))
+
+    print("Failed to find a path from", state, control.failure())
+    return None
+
+
+def beam_search(graph, state, is_goal, limit, width=50, max_nodes=None, control=None):
+    # Beam search: expands the search one layer at a time, keeping only the width successors with
+    # the lowest heuristic value (ties broken by in-game cost so far). Each beam member carries its
+    # chain of recipe names as a linked list (name, parent chain), as in bitstate_search(), so
+    # only the chains of the current beam are kept alive; successors are cut back to the best
+    # width whenever there are 2 * width of them, so memory stays within a few times width nodes.
+    # There is no closed list: a state is only dropped as a duplicate within one layer. max_nodes
+    # and control apply to the live nodes, checked before every expansion.
+    # Returns the same tuple as greedy_search(); plans are never guaranteed optimal, and a
+    # too-narrow beam can miss a plan altogether.
+    control = control or SearchControl(limit, max_nodes)
+    initial_state = state.copy()
+    control.start(initial_state)
+    layer = [(0, 0, initial_state, None)]
+    generated = 1
+    while layer:
+        candidates = []
+        seen = set(current_state for _, _, current_state, _ in layer)
+        for _, cost, current_state, chain in layer:
+            if not control.keep_going(len(layer) + len(candidates)):
+                print("Failed to find a path from", state, control.failure())
+                return None
+            if is_goal(current_state):
+                path = []
+                while chain is not None:
+                    path.append(chain[0])
+                    chain = chain[1]
+                return (path[::-1], control.elapsed(), generated, False)
+            for name, resulting_state, time_cost, heuristic in graph(current_state):
+                if resulting_state not in seen:
+                    seen.add(resulting_state)
+                    generated += 1
+                    candidates.append((heuristic(resulting_state), cost + time_cost, resulting_state,
+                                       (name, chain)))
+            if len(candidates) >= 2 * width:
+                candidates = nsmallest(width, candidates, key=itemgetter(0, 1))
+                seen = set(current_state for _, _, current_state, _ in layer + candidates)
+        layer = nsmallest(width, candidates, key=itemgetter(0, 1))
+
+    print("Failed to find a path from", state, control.failure())
     return None
 
 
-def bidirecitonal_search(graph, state, is_goal, limit, reverse_graph, end, is_start):
-    start_time = time()
+def multi_goal_search(graph, state, goals, limit, heuristics=None, pruned_after=None, control=None):
+    # Uniform-cost search from state towards several goals at once, each a dict like
+    # Crafting['Goal']. Every expanded state is checked against each goal still pending; states are
+    # expanded in order of in-game cost, so the first one meeting a goal ends a cheapest plan for
+    # it. heuristics, when given, holds one admissible, non-negative heuristic per goal; the least
+    # estimate over the goals still pending is added to the priority, which keeps each goal's plan
+    # optimal (dropping solved goals only raises later estimates).
+    # Yields (goal index, path, in-game cost, computation time, number of states) for each goal as
+    # soon as it is solved, then (goal index, None, None, ...) for each goal left when it stops.
+    control = control or SearchControl(limit)
+    initial_state = state.copy()
+    control.start(initial_state)
+    pending = OrderedDict((index, make_goal_checker(goal)) for index, goal in enumerate(goals))
+    costs = {initial_state: 0}
+    previous_recipe = {initial_state: (None, None)}
+    queue = [(0, 0, initial_state)]
+    while pending and queue and control.keep_going(len(costs)):
+        _, cost, current_state = heappop(queue)
+        if cost > costs[current_state]:
+            continue
+        for index, is_goal in list(pending.items()):
+            if is_goal(current_state):
+                del pending[index]
+                node = current_state
+                path = []
+                while previous_recipe[node][0] is not None:
+                    path.append(previous_recipe[node][0])
+                    node = previous_recipe[node][1]
+                yield (index, path[::-1], cost, control.elapsed(), len(costs))
+        if pruned_after:
+            successors = graph(current_state, pruned_after.get(previous_recipe[current_state][0], ()))
+        else:
+            successors = graph(current_state)
+        for name, resulting_state, time_cost, heuristic in successors:
+            new_cost = cost + time_cost
+            if resulting_state not in costs or new_cost < costs[resulting_state]:
+                costs[resulting_state] = new_cost
+                previous_recipe[resulting_state] = (name, current_state)
+                estimate = min(heuristics[index](resulting_state) for index in pending) if heuristics else 0
+                heappush(queue, (new_cost + estimate, new_cost, resulting_state))
+
+    for index in pending:
+        print("Failed to find a path from", state, "to", goals[index], control.failure())
+        yield (index, None, None, control.elapsed(), len(costs))
+
+
+def bidirecitonal_search(graph, state, is_goal, limit, reverse_graph, end, is_start, control=None):
+    control = control or SearchControl(limit)
     initial_state = state.copy()
     end_state = end.copy()
+    control.start(initial_state)
     f_times = {initial_state: 0}
     r_times = {end_state: 0}
     f_previous_recipe = {initial_state: (None, None)}
@@ -291,7 +1323,7 @@ def bidirecitonal_search(graph, state, is_goal, limit, reverse_graph, end, is_st
     reverse_progress = 0
 
     # Search
-    while time() - start_time < limit and queue:
+    while queue and control.keep_going(len(f_times) + len(r_times)):
         # Continue with next min unvisited node
         current_game_time, current_state, dst_or_src = heappop(queue)
         if dst_or_src == 'dst':
@@ -312,7 +1344,7 @@ def bidirecitonal_search(graph, state, is_goal, limit, reverse_graph, end, is_st
             while r_previous_recipe[node][0] is not None:
                 path.append(r_previous_recipe[node][0])
                 node = r_previous_recipe[node][1]
-            total_time = time() - start_time
+            total_time = control.elapsed()
             return (path, total_time)
 
         times = f_times if dst_or_src == 'dst' else r_times
@@ -349,26 +1381,36 @@ def bidirecitonal_search(graph, state, is_goal, limit, reverse_graph, end, is_st
 
     # Failed to find a path
     # print(time() - start_time)
-    print("Failed to find a path from", state, 'within time limit.')
+    print("Failed to find a path from", state, control.failure())
     return None
 
 
 # Search
-def backsearch(reverse_graph, end, is_start, limit):
-    start_time = time()
+def backsearch(reverse_graph, end, is_start, limit, bitstate=None, control=None, trace=None):
+    if bitstate is not None:
+        results = bitstate_search(reverse_graph, end.copy(), is_start, limit, bitstate, False, None, control)
+        return results and results[:2]
+    control = control or SearchControl(limit)
     end_state = end.copy()
+    control.start(end_state)
     times = {end_state: 0}
     previous_recipe = {end_state: (None, None)}
+    if trace is not None:
+        trace.start(end_state)
     queue = [(0, end_state)]
     known_recipes = {}
     current_state = None
 
     # Search
-    while time() - start_time < limit and queue:
+    while queue and control.keep_going(len(times)):
         current_game_time, current_state = heappop(queue)
         # print("cur " + str(current_state))
+        if trace is not None:
+            trace.expanded(current_state, current_game_time)
         if is_start(current_state):
             # print (current_game_time)
+            if trace is not None:
+                trace.goal(current_state, current_game_time)
             node = None
             if previous_recipe[current_state] is not None:
                 node = current_state
@@ -377,23 +1419,27 @@ def backsearch(reverse_graph, end, is_start, limit):
                 path.append(previous_recipe[node][0])
                 node = previous_recipe[node][1]
                 # print(previous_recipe[node][0])
-            total_time = time() - start_time
+            total_time = control.elapsed()
             # print (path)
             # print(current_state)
             # print(current_game_time)
             # print(total_time)
             return (path, total_time)
         for name, resulting_state, time_cost, heuristic in reverse_graph(current_state):
-            new_time = current_game_time + heuristic(resulting_state)
+            # As in search(), times holds the priority each state was reached from, so the
+            # heuristic is only evaluated for states which aren't duplicates.
             # print("go " + name)
             # print(resulting_state)
             # if resulting_state in times:
             # print("res " + str(times[resulting_state]))
-            # print(new_time)
-            if resulting_state not in times or new_time < times[resulting_state]:
+            if resulting_state not in times or current_game_time < times[resulting_state]:
+                estimate = heuristic(resulting_state)
+                new_time = current_game_time + estimate
                 # print (new_time)
-                times[resulting_state] = new_time
+                times[resulting_state] = current_game_time
                 previous_recipe[resulting_state] = (name, current_state)
+                if trace is not None:
+                    trace.generated(resulting_state, current_state, name, time_cost, estimate)
                 # print("he " + name)
                 if name not in known_recipes:
                     known_recipes[name] = 0
@@ -403,7 +1449,7 @@ def backsearch(reverse_graph, end, is_start, limit):
 
     # Failed to find a path
     # print(time() - start_time)
-    print("Failed to find a path from", state, 'within time limit.')
+    print("Failed to find a path from", end, control.failure())
     return None
 
 
@@ -421,22 +1467,46 @@ if __name__ == '__main__':
     # Dict of crafting recipes (each is a dict):
     print('Example recipe:','craft stone_pickaxe at bench ->',Crafting['Recipes']['craft stone_pickaxe at bench'])
     '''
-    # Build rules
-    all_recipes = []
-    all_ingredients = []
-    for name, rule in Crafting['Recipes'].items():
-        checker = make_checker(rule)
-        effector = make_effector(rule)
-        heuristic = make_heuristic(Crafting['Goal'])
-        back_heuristic = make_heuristic(Crafting['Initial'])
-        back_checker = make_back_checker(rule)
-        deffector = make_deffector(rule)
-        recipe = Recipe(name, checker, effector, rule['Time'], heuristic)
-        ingredient = None
-        for product, quantity in rule["Produces"].items():
-            ingredient = Ingredient(name, back_checker, deffector, rule['Time'], back_heuristic)
-        all_recipes.append(recipe)
-        all_ingredients.append(ingredient)
+    # Strip recipes and items that can never help produce the goal
+    Crafting, pruning_report = prune_irrelevant(Crafting)
+    print_pruning_report(pruning_report)
+
+    # Bail out early if some goal item can never be produced
+    reachability = check_reachability(Crafting)
+    if not reachability.solvable:
+        print("Unsolvable: no way to produce " + ", ".join(reachability.unreachable_goals))
+        raise SystemExit(1)
+
+    # Lower bound on the cost of each goal item from nothing
+    cost_table = CostTable(Crafting)
+    for item, quantity in Crafting['Goal'].items():
+        cost, best = cost_table.query(item, quantity)
+        print("Cheapest " + item + ": at least " + str(cost) + " via " + str(best))
+
+    # Add macro-operators learned for this recipe set, or derived from single-consumer chains
+    macros = {}
+    search_crafting = Crafting
+    if use_macros:
+        macros = load_macros(Crafting) or chain_macros(Crafting)
+        search_crafting = add_macros(Crafting, macros)
+
+    # Build rules, optionally guided by pattern databases or a cost-to-go table cached on disk for this
+    # recipe set and goal
+    heuristic = None
+    if use_pdb:
+        from craft_pdb import get_pattern_databases, make_pdb_heuristic
+        heuristic = make_pdb_heuristic(get_pattern_databases(Crafting))
+    elif use_lp:
+        from craft_lp import make_lp_heuristic
+        heuristic = make_lp_heuristic(Crafting)
+    heuristic = heuristic or make_heuristic(Crafting['Goal'])
+    if use_cost_to_go:
+        from craft_cost_to_go import get_cost_to_go, make_cost_to_go_heuristic, print_cost_to_go_report
+        cost_to_go = get_cost_to_go(Crafting)
+        print_cost_to_go_report(cost_to_go)
+        heuristic = make_cost_to_go_heuristic(cost_to_go, heuristic)
+    heuristic = HeuristicCache(heuristic)
+    all_recipes, all_ingredients = build_rules(search_crafting, heuristic)
 
     # Create a function which checks for the goal
     is_goal = make_goal_checker(Crafting['Goal'])
@@ -465,9 +1535,51 @@ if __name__ == '__main__':
     # Search - This is you!
     #results = bidirecitonal_search(graph, state, is_goal, 30, reverse_graph, goal, is_start)
     # results = backsearch(reverse_graph, goal, is_start, 30)
-    results = search(graph, state, is_goal, 30)
+    successors = graph
+    if use_bulk_actions:
+        successors = make_bulk_graph(search_crafting, item_demand(Crafting, reachability))
+    landmarks = find_landmarks(Crafting) if use_landmarks else None
+    bitstate = BitStateTable() if use_bitstate else None
+    # Search canonical representatives of symmetric states; commutativity pruning is switched off
+    # with it, since the two reductions aren't known to be safe together.
+    search_state = state
+    pruned_after = make_commutativity(search_crafting)
+    if use_symmetry:
+        from craft_symmetry import find_symmetries, make_symmetric_graph, make_canonicalizer, concrete_plan, \
+            print_symmetry_report
+        symmetry = find_symmetries(search_crafting)
+        print_symmetry_report(symmetry)
+        successors = make_symmetric_graph(successors, symmetry)
+        search_state = make_canonicalizer(symmetry)(state)[0]
+        pruned_after = None
+    control = SearchControl(30, max_nodes, memory_limit, track_memory=track_memory)
+    if search_mode == 'greedy':
+        results = greedy_search(successors, search_state, is_goal, 30, control=control)
+    elif search_mode == 'beam':
+        results = beam_search(successors, search_state, is_goal, 30, beam_width, control=control)
+    else:
+        trace = None
+        if trace_file:
+            from craft_trace import TraceRecorder
+            trace = TraceRecorder(trace_file)
+        results = search(successors, search_state, is_goal, 30, pruned_after, landmarks, bitstate, control, trace)
+        if trace is not None:
+            trace.close()
+    control.finish()
+    if bitstate is not None:
+        print_bitstate_report(bitstate)
+    print_heuristic_cache_report(heuristic)
     if (results != None):
-        action_list = results[0]
+        path = results[0]
+        if use_symmetry:
+            path = concrete_plan(path, state, symmetry, search_crafting)
+        action_list = expand_macros(expand_bulk(path), macros)
+        action_list, saved_cost = optimize_plan(Crafting, action_list, state, is_goal,
+                                                dict((r.name, r) for r in all_recipes))
+        if use_macros:
+            learned = load_macros(Crafting)
+            learned.update(mine_macros(Crafting, [action_list]))
+            save_macros(Crafting, learned)
         real_time_taken = results[1]
         num_steps = results[2]
         if action_list != None:
@@ -475,6 +1587,9 @@ if __name__ == '__main__':
                 print(action)
         for recipe in action_list:
             total_cost += Crafting['Recipes'][recipe]['Time']
-        print("In game cost: " + str(total_cost))
+        print("In game cost: " + str(total_cost) + " (" + str(saved_cost) + " saved by post-optimization)")
+        schedule = schedule_plan(Crafting, action_list, Crafting['Initial'], crafters)
+        print("Makespan with " + str(crafters) + " crafters: " + str(schedule.makespan))
         print("Computation time: " + str(real_time_taken) + " seconds")
+        print_memory_report(control)
         print("Number of states: " + str(num_steps))
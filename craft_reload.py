@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from timeit import default_timer as time
+
+import craft_planner as planner
+
+RecipeDiff = namedtuple('RecipeDiff', ['added', 'removed', 'changed', 'items_changed'])
+Snapshot = namedtuple('Snapshot', ['version', 'crafting', 'rules', 'all_recipes', 'all_ingredients',
+                                   'cost_table', 'goals'])
+GoalEntry = namedtuple('GoalEntry', ['relevant', 'recipes', 'graph', 'is_goal', 'pruned_after', 'heuristic',
+                                     'plans'])
+
+
+def diff_recipes(old, new):
+    # Recipes added, removed and changed between two recipe sets, and whether the item list changed.
+    added = [name for name in new['Recipes'] if name not in old['Recipes']]
+    removed = [name for name in old['Recipes'] if name not in new['Recipes']]
+    changed = [name for name in new['Recipes']
+               if name in old['Recipes'] and new['Recipes'][name] != old['Recipes'][name]]
+    return RecipeDiff(added, removed, changed, list(old['Items']) != list(new['Items']))
+
+
+def compile_rule(name, rule):
+    # The Recipe and Ingredient build_rules() would make for one rule, without heuristics: those
+    # depend on the goal, and each goal's graph supplies its own.
+    recipe = planner.Recipe(name, planner.make_checker(rule), planner.make_effector(rule), rule['Time'], None)
+    ingredient = None
+    if rule['Produces']:
+        ingredient = planner.Ingredient(name, planner.make_back_checker(rule), planner.make_deffector(rule),
+                                        rule['Time'], None)
+    return recipe, ingredient
+
+
+def make_snapshot(version, crafting, rules, cost_table, goals):
+    names = list(crafting['Recipes'].keys())
+    return Snapshot(version, crafting, rules, [rules[name][0] for name in names],
+                    [rules[name][1] for name in names], cost_table, goals)
+
+
+class RecipeSet:
+    """ A compiled recipe set which can be replaced by an edited version while plans are being
+        made. Everything a request uses hangs off one immutable Snapshot, which a request reads
+        once; reload() builds the next snapshot on the side and swaps it in with one assignment,
+        so requests in flight finish on the version they started with.
+
+        A reload recompiles only the added and changed rules, updates the cost table
+        incrementally, and keeps the compiled graph, heuristic cache and cached plans of every goal
+        the edit can't affect: one none of whose relevant recipes was changed or removed, and none
+        of whose relevant items an added or changed recipe now produces. If the item list changed,
+        states change shape, so every goal is dropped.
+    """
+
+    def __init__(self, crafting):
+        rules = dict((name, compile_rule(name, rule)) for name, rule in crafting['Recipes'].items())
+        self.snapshot = make_snapshot(0, crafting, rules, planner.CostTable(crafting), {})
+        self.lock = threading.Lock()
+        # Number of rules compiled, to see how much a reload had to redo.
+        self.compiled = len(rules)
+
+    def goal_entry(self, snapshot, goal):
+        # Compiles the search graph for a goal on first use: the relevant recipes of the snapshot,
+        # with bulk actions and a cached heuristic. Returns None if the goal is unsolvable.
+        key = tuple(sorted(goal.items()))
+        if key in snapshot.goals:
+            return snapshot.goals[key]
+        crafting = dict(snapshot.crafting, Goal=dict(goal))
+        reachability = planner.check_reachability(crafting)
+        entry = None
+        if reachability.solvable:
+            relevant, recipes = planner.relevant_items(crafting)
+            heuristic = planner.HeuristicCache(planner.make_heuristic(goal))
+            graph = planner.make_bulk_graph(crafting, planner.item_demand(crafting, reachability),
+                                            [r for r in snapshot.all_recipes if r.name in recipes], heuristic)
+            entry = GoalEntry(set(relevant), set(recipes), graph, planner.make_goal_checker(goal),
+                              planner.make_commutativity(crafting), heuristic, {})
+        snapshot.goals[key] = entry
+        return entry
+
+    def plan(self, goal=None, initial=None, limit=30):
+        # Returns (plan, computation time, number of states, version) from initial to goal (the
+        # recipe set's own by default), or None. Plans are cached per goal and initial inventory.
+        snapshot = self.snapshot
+        goal = goal if goal is not None else snapshot.crafting['Goal']
+        initial = initial if initial is not None else snapshot.crafting['Initial']
+        entry = self.goal_entry(snapshot, goal)
+        if entry is None:
+            return None
+        key = tuple(sorted(initial.items()))
+        if key not in entry.plans:
+            state = planner.State({item: 0 for item in snapshot.crafting['Items']})
+            state.update(initial)
+            results = planner.search(entry.graph, state, entry.is_goal, limit, entry.pruned_after)
+            if results is None:
+                return None
+            entry.plans[key] = (planner.expand_bulk(results[0]), results[1], results[2], snapshot.version)
+        return entry.plans[key]
+
+    def reload(self, crafting):
+        # Swaps in an edited recipe set; returns the RecipeDiff it applied.
+        with self.lock:
+            old = self.snapshot
+            diff = diff_recipes(old.crafting, crafting)
+            rules = dict(old.rules)
+            for name in diff.removed:
+                del rules[name]
+            for name in diff.added + diff.changed:
+                rules[name] = compile_rule(name, crafting['Recipes'][name])
+            self.compiled += len(diff.added) + len(diff.changed)
+            cost_table = old.cost_table.copy()
+            for name in diff.removed:
+                cost_table.remove_recipe(name)
+            for name in diff.changed:
+                old_rule, rule = old.crafting['Recipes'][name], crafting['Recipes'][name]
+                if dict(old_rule, Time=rule['Time']) == rule:
+                    cost_table.set_time(name, rule['Time'])
+                else:
+                    cost_table.remove_recipe(name)
+                    cost_table.add_recipe(name, rule)
+            for name in diff.added:
+                cost_table.add_recipe(name, crafting['Recipes'][name])
+            stale = set(diff.removed + diff.changed)
+            products = set(item for name in diff.added + diff.changed
+                           for item in crafting['Recipes'][name]['Produces'])
+            goals = {}
+            if not diff.items_changed:
+                for key, entry in list(old.goals.items()):
+                    if entry is not None and not entry.recipes & stale and not entry.relevant & products:
+                        goals[key] = entry
+            self.snapshot = make_snapshot(old.version + 1, crafting, rules, cost_table, goals)
+            return diff
+
+
+def print_reload_report(diff, kept, dropped):
+    print("Reloaded recipes: %d added, %d removed, %d changed%s; kept %d goals, dropped %d" % (
+        len(diff.added), len(diff.removed), len(diff.changed), ", items changed" if diff.items_changed else "",
+        kept, dropped))
+
+
+class RecipeWatcher:
+    """ Polls a recipe file and reloads recipe_set whenever the file's modification time or size
+        changes. A file that is missing or doesn't load (e.g. caught mid-write) is skipped and tried
+        again on the next poll; the current recipe set stays in use meanwhile.
+    """
+
+    def __init__(self, path, recipe_set, interval=1.0, on_reload=None):
+        self.path = path
+        self.recipe_set = recipe_set
+        self.interval = interval
+        self.on_reload = on_reload
+        self.signature = self.stat()
+        self.failed = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        # Reloads if the file changed; returns the RecipeDiff applied, or None. A file that is
+        # missing (e.g. mid-rename by an editor), doesn't parse or isn't a valid recipe set leaves
+        # the current recipe set in place: the error is printed once and the next poll tries again.
+        signature = None
+        try:
+            signature = self.stat()
+            if signature == self.signature:
+                return None
+            with open(self.path) as f:
+                crafting = json.load(f)
+            goals = len(self.recipe_set.snapshot.goals)
+            diff = self.recipe_set.reload(crafting)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            if (signature, str(error)) != self.failed:
+                print("Not reloading " + self.path + ": " + repr(error))
+                self.failed = (signature, str(error))
+            return None
+        self.signature = signature
+        self.failed = None
+        kept = len(self.recipe_set.snapshot.goals)
+        print_reload_report(diff, kept, goals - kept)
+        if self.on_reload is not None:
+            self.on_reload(diff)
+        return diff
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == '__main__':
+    import sys
+    # Usage: python craft_reload.py Crafting.json; edit the file while it runs to see it replan.
+    path = sys.argv[1] if len(sys.argv) > 1 else 'Crafting.json'
+    with open(path) as f:
+        recipe_set = RecipeSet(json.load(f))
+
+    def replan(diff):
+        start = time()
+        results = recipe_set.plan()
+        print("Version " + str(recipe_set.snapshot.version) + ": " +
+              (str(len(results[0])) + " steps" if results else "no plan") +
+              " (%.3f seconds)" % (time() - start))
+
+    replan(None)
+    watcher = RecipeWatcher(path, recipe_set, on_reload=replan)
+    watcher.start()
+    try:
+        watcher.stopped.wait()
+    except KeyboardInterrupt:
+        watcher.stop()
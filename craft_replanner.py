@@ -0,0 +1,304 @@
+from collections import defaultdict
+from heapq import heappop, heappush
+from timeit import default_timer as time
+
+import numpy as np
+
+infinity = float('inf')
+chunk_size = 4000000
+
+
+def make_regressor(rule, index):
+    # Returns a function which maps a requirement (the least inventory needed to finish the plan
+    # from here, as a tuple ordered like Crafting['Items']) to the requirement before applying the
+    # rule, or None if the rule doesn't produce anything the requirement still needs.
+    # Requirements are plain tuples because they are hashed on every lookup.
+    produces = [(index[item], quantity) for item, quantity in rule['Produces'].items()]
+    consumes = [(index[item], quantity) for item, quantity in rule.get('Consumes', {}).items()]
+    requires = [index[item] for item in rule.get('Requires', {}).keys()]
+
+    def regress(requirement):
+        if not any(requirement[i] > 0 for i, quantity in produces):
+            return None
+        previous = list(requirement)
+        for i, quantity in produces:
+            previous[i] = max(previous[i] - quantity, 0)
+        for i, quantity in consumes:
+            previous[i] += quantity
+        for i in requires:
+            if previous[i] < 1:
+                previous[i] = 1
+        return tuple(previous)
+
+    return regress
+
+
+def satisfies(inventory, requirement):
+    for have, need in zip(inventory, requirement):
+        if have < need:
+            return False
+    return True
+
+
+def support(requirements):
+    # Bit mask of the items each requirement needs, over the first 62 items: a requirement can only
+    # be at most another if its mask is a subset of the other's, which rules out most pairs cheaply.
+    requirements = np.asarray(requirements)
+    bits = np.left_shift(1, np.arange(min(requirements.shape[-1], 62)), dtype=np.int64)
+    return (requirements[..., :len(bits)] > 0) @ bits
+
+
+def first_dominator(candidates, cost, rows, row_costs, row_masks):
+    # For each candidate requirement, the index of the first row which is componentwise at most it
+    # and costs no more than cost, or -1. Only pairs whose masks allow it are compared in full, a
+    # chunk of candidates at a time to bound the memory used.
+    result = np.full(len(candidates), -1)
+    if len(rows) == 0:
+        return result
+    masks = support(candidates)
+    cheap = row_costs <= cost
+    step = max(1, chunk_size // len(rows))
+    for start in range(0, len(candidates), step):
+        chunk = candidates[start:start + step]
+        allowed = ((row_masks[None, :] & ~masks[start:start + step, None]) == 0) & cheap[None, :]
+        pairs_i, pairs_j = np.nonzero(allowed)
+        within = (rows[pairs_j] <= chunk[pairs_i]).all(axis=1)
+        found, first = np.unique(pairs_i[within], return_index=True)
+        result[start + found] = pairs_j[within][first]
+    return result
+
+
+class Replanner:
+    """ Incremental planner over requirements (the least inventory from which the rest of the plan
+        can be carried out). A uniform-cost search runs backward from the goal, so the g-values are
+        costs-to-goal which don't depend on the inventory; it runs only until a requirement the
+        inventory satisfies is settled, and is resumed rather than restarted when more is needed.
+        A requirement at least as large as a settled one which is no dearer is set aside, since
+        anything regressed from it is no better than what is regressed from that one. That keeps
+        the explored graph small enough that
+        - an inventory change looks the inventory up among the settled requirements, and resumes
+          the search only if none of them is satisfied;
+        - a recipe getting cheaper regresses the settled requirements through that recipe alone
+          and propagates whatever improves;
+        - a recipe getting dearer removes only the requirements whose plan used it, and puts back
+          the entries that were set aside because of them; if that is most of the requirements,
+          it starts over instead.
+    """
+
+    def __init__(self, crafting, inventory):
+        self.crafting = crafting
+        self.costs = {name: rule['Time'] for name, rule in crafting['Recipes'].items()}
+        self.items = list(crafting['Items'])
+        index = {item: i for i, item in enumerate(self.items)}
+        self.regressors = {name: make_regressor(rule, index) for name, rule in crafting['Recipes'].items()}
+        self.inventory = tuple(inventory.get(item, 0) for item in self.items)
+        self.goal = tuple(crafting['Goal'].get(item, 0) for item in self.items)
+        self.reset()
+
+    def reset(self):
+        # Forgets everything explored, to search again from the goal.
+        # g and parent (recipe, requirement it leads to) of every settled requirement, and the
+        # requirements settled through each one.
+        self.g = {}
+        self.parent = {}
+        self.children = defaultdict(set)
+        # Settled requirements, in the first count rows of a matrix for the dominance check, with
+        # their costs; the matrix doubles when full.
+        self.order = []
+        self.position = {}
+        self.count = 0
+        self.rows = np.zeros((64, len(self.items)), dtype=np.int64)
+        self.row_costs = np.zeros(64)
+        self.row_masks = np.zeros(64, dtype=np.int64)
+        # Queue entries are (cost, requirement, recipe, requirement it leads to). Entries dropped
+        # because their requirement was settled no dearer are kept in set_aside under it, and
+        # requirements dropped as dominated under the dominating one, to be put back if it goes.
+        self.queue = [(0, self.goal, None, None)]
+        self.set_aside = defaultdict(list)
+        self.dominated = defaultdict(list)
+        self.best = None
+
+    def push(self, name, successor):
+        if successor not in self.g:
+            return
+        previous = self.regressors[name](successor)
+        if previous is None or previous == successor:
+            return
+        cost = self.g[successor] + self.costs[name]
+        if cost < self.g.get(previous, infinity):
+            heappush(self.queue, (cost, previous, name, successor))
+        else:
+            self.set_aside[previous].append((name, successor))
+
+    def restore(self, requirement):
+        # Puts back what was set aside because of a requirement which is no longer settled.
+        for name, successor in self.set_aside.pop(requirement, ()):
+            self.push(name, successor)
+        for other in self.dominated.pop(requirement, ()):
+            self.restore(other)
+
+    def settle(self, requirement, cost, name, successor):
+        if requirement in self.g:
+            old_successor = self.parent[requirement][1]
+            self.children[old_successor].discard(requirement)
+            self.row_costs[self.position[requirement]] = cost
+        else:
+            if self.count == len(self.rows):
+                self.rows = np.concatenate([self.rows, np.zeros_like(self.rows)])
+                self.row_costs = np.concatenate([self.row_costs, np.zeros_like(self.row_costs)])
+                self.row_masks = np.concatenate([self.row_masks, np.zeros_like(self.row_masks)])
+            self.position[requirement] = self.count
+            self.order.append(requirement)
+            self.rows[self.count] = requirement
+            self.row_costs[self.count] = cost
+            self.row_masks[self.count] = support(requirement)
+            self.count += 1
+        self.g[requirement] = cost
+        self.parent[requirement] = (name, successor) if name is not None else None
+        if name is not None:
+            self.children[successor].add(requirement)
+        for recipe in self.regressors:
+            self.push(recipe, requirement)
+        if satisfies(self.inventory, requirement) and (self.best is None or cost < self.g[self.best]):
+            self.best = requirement
+
+    def settle_level(self):
+        # Settles every queued requirement at the lowest cost which isn't set aside. Candidates go
+        # smallest first, so one dominated by another of the same level finds it already settled.
+        cost = self.queue[0][0]
+        level = {}
+        while self.queue and self.queue[0][0] == cost:
+            _, requirement, name, successor = heappop(self.queue)
+            if name is not None and self.g.get(successor, infinity) + self.costs[name] != cost:
+                continue
+            if requirement in level or cost >= self.g.get(requirement, infinity):
+                self.set_aside[requirement].append((name, successor))
+                continue
+            level[requirement] = (name, successor)
+        if not level:
+            return
+        candidates = sorted(level, key=sum)
+        earlier = self.count
+        dominators = first_dominator(np.array(candidates, dtype=np.int64), cost, self.rows[:earlier],
+                                     self.row_costs[:earlier], self.row_masks[:earlier])
+        for requirement, dominator in zip(candidates, dominators):
+            if dominator < 0 and self.count > earlier:
+                within = (self.rows[earlier:self.count] <= requirement).all(axis=1)
+                if within.any():
+                    dominator = earlier + int(within.argmax())
+            if dominator >= 0:
+                self.set_aside[requirement].append(level[requirement])
+                self.dominated[self.order[dominator]].append(requirement)
+                continue
+            self.settle(requirement, cost, *level[requirement])
+
+    def find_best(self):
+        # The cheapest settled requirement the inventory satisfies, or None.
+        satisfied = (self.rows[:self.count] <= np.array(self.inventory)).all(axis=1)
+        if not satisfied.any():
+            return None
+        return self.order[int(np.where(satisfied, self.row_costs[:self.count], infinity).argmin())]
+
+    def compute_shortest_path(self, start_time, limit):
+        # Resumes the search until no queued requirement could be cheaper than the best one the
+        # inventory satisfies; returns whether one was found in time.
+        while self.queue and (self.best is None or self.queue[0][0] < self.g[self.best]):
+            if time() - start_time >= limit:
+                return False
+            self.settle_level()
+        return self.best is not None
+
+    def extract_path(self, u):
+        path = []
+        while self.parent[u] is not None:
+            name, u = self.parent[u]
+            path.append(name)
+        return path
+
+    def stock(self):
+        return dict((item, quantity) for item, quantity in zip(self.items, self.inventory) if quantity > 0)
+
+    def plan(self, limit=30, start_time=None):
+        # Returns (path, computation time, number of states) like search(), or None. Time is
+        # counted from start_time when given, so updates include their own bookkeeping.
+        start_time = start_time or time()
+        if not self.compute_shortest_path(start_time, limit):
+            print("Failed to find a path from", self.stock(), 'within time limit.')
+            return None
+        return (self.extract_path(self.best), time() - start_time, len(self.g))
+
+    def update_inventory(self, delta, limit=30):
+        # Applies an inventory delta, e.g. {'wood': 2, 'plank': -1}, and returns the repaired plan.
+        # The g-values are costs-to-goal, so they all stay valid.
+        start_time = time()
+        inventory = list(self.inventory)
+        for item, quantity in delta.items():
+            i = self.items.index(item)
+            inventory[i] = max(inventory[i] + quantity, 0)
+        self.inventory = tuple(inventory)
+        self.best = self.find_best()
+        return self.plan(limit, start_time)
+
+    def update_cost(self, recipe, cost, limit=30):
+        # Changes a recipe's Time and repairs only the requirements it can affect.
+        start_time = time()
+        old_cost = self.costs[recipe]
+        self.costs[recipe] = cost
+        if cost < old_cost:
+            for requirement in list(self.order):
+                self.push(recipe, requirement)
+        elif cost > old_cost:
+            removed = set()
+            stack = [u for u, parent in self.parent.items() if parent is not None and parent[0] == recipe]
+            while stack:
+                u = stack.pop()
+                if u not in removed:
+                    removed.add(u)
+                    stack.extend(self.children.get(u, ()))
+            # Putting back what the removed requirements had set aside costs more than starting
+            # over once they are most of what was explored.
+            if 2 * len(removed) > self.count:
+                self.reset()
+                return self.plan(limit, start_time)
+            for u in removed:
+                self.children.pop(u, None)
+            edges = [self.parent.pop(u) for u in removed]
+            for u in removed:
+                del self.g[u]
+            for name, successor in edges:
+                self.children[successor].difference_update(removed)
+            keep = [i for i, u in enumerate(self.order) if u not in removed]
+            self.order = [self.order[i] for i in keep]
+            self.position = dict((u, i) for i, u in enumerate(self.order))
+            self.count = len(keep)
+            self.rows[:self.count] = self.rows[keep]
+            self.row_costs[:self.count] = self.row_costs[keep]
+            self.row_masks[:self.count] = self.row_masks[keep]
+            for name, successor in edges:
+                self.push(name, successor)
+            for u in removed:
+                self.restore(u)
+            # Entries regressed through the recipe from requirements still settled were dropped
+            # as stale when its cost went up; push them again at the new cost.
+            for requirement in list(self.order):
+                self.push(recipe, requirement)
+        self.best = self.find_best()
+        return self.plan(limit, start_time)
+
+
+if __name__ == '__main__':
+    import json
+    with open('Crafting.json') as f:
+        Crafting = json.load(f)
+
+    replanner = Replanner(Crafting, Crafting['Initial'])
+    for label, step in [('Initial plan', lambda: replanner.plan()),
+                        ('After picking up 3 wood', lambda: replanner.update_inventory({'wood': 3})),
+                        ('After losing the wood', lambda: replanner.update_inventory({'wood': -3})),
+                        ('After mining cobble gets faster', lambda: replanner.update_cost('wooden_pickaxe for cobble', 2))]:
+        results = step()
+        if results is not None:
+            print(label + ": " + ", ".join(results[0]))
+            print("In game cost: " + str(sum(replanner.costs[recipe] for recipe in results[0])))
+            print("Computation time: " + str(results[1]) + " seconds")
+            print("Number of states: " + str(results[2]))
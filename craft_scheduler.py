@@ -0,0 +1,122 @@
+from collections import namedtuple, defaultdict, deque
+from heapq import heappop, heappush
+
+Schedule = namedtuple('Schedule', ['makespan', 'sequential_cost', 'lower_bound', 'steps'])
+ScheduledStep = namedtuple('ScheduledStep', ['index', 'name', 'crafter', 'start', 'end'])
+
+
+def precedence_graph(crafting, plan, initial):
+    # Replays the plan tracking every unit as (item, producing step or None if initial, number).
+    # Each consumed unit is taken from the earliest step (or the initial inventory) that made it,
+    # and that step must finish first. Each Requires can be served by any unit of the tool held at
+    # that point of the plan, so its step waits only for the earliest one; which unit it holds is
+    # chosen when it is scheduled. A step which consumes an item also waits for every earlier step
+    # which required it, so a tool isn't used up while in use.
+    # Returns the predecessors of each step, and for each step the tools it needs as
+    # (item, candidate units) pairs.
+    units = defaultdict(deque)
+    for item, quantity in initial.items():
+        units[item].extend((item, None, k) for k in range(quantity))
+    users = defaultdict(list)
+    predecessors = [set() for _ in plan]
+    tools = [[] for _ in plan]
+    for index, name in enumerate(plan):
+        rule = crafting['Recipes'][name]
+        for item in rule.get('Requires', {}).keys():
+            producer = units[item][0][1]
+            if producer is not None:
+                predecessors[index].add(producer)
+            tools[index].append((item, list(units[item])))
+            users[item].append(index)
+        for item, quantity in rule.get('Consumes', {}).items():
+            for _ in range(quantity):
+                producer = units[item].popleft()[1]
+                if producer is not None:
+                    predecessors[index].add(producer)
+            predecessors[index].update(users[item])
+        for item, quantity in rule['Produces'].items():
+            units[item].extend((item, index, k) for k in range(quantity))
+    return predecessors, tools
+
+
+def critical_path(crafting, plan, predecessors):
+    # Longest remaining Time from the start of each step to the end of the plan.
+    successors = [[] for _ in plan]
+    for index, before in enumerate(predecessors):
+        for other in before:
+            successors[other].append(index)
+    remaining = [0] * len(plan)
+    for index in reversed(range(len(plan))):
+        time_cost = crafting['Recipes'][plan[index]]['Time']
+        remaining[index] = time_cost + max([remaining[after] for after in successors[index]] or [0])
+    return remaining
+
+
+def schedule_plan(crafting, plan, initial, crafters=2):
+    # List-schedules a plan on a number of parallel crafters, always starting the ready step with
+    # the longest critical path first. A tool unit can only be held by one crafter at a time; a
+    # step takes the first candidate unit that has been made and is free, and waits if none is.
+    predecessors, tools = precedence_graph(crafting, plan, initial)
+    remaining = critical_path(crafting, plan, predecessors)
+    waiting = [len(before) for before in predecessors]
+    successors = [[] for _ in plan]
+    for index, before in enumerate(predecessors):
+        for other in before:
+            successors[other].append(index)
+    ready = [(-remaining[index], index) for index in range(len(plan)) if waiting[index] == 0]
+    running = []
+    free_crafters = list(range(crafters))
+    in_use = set()
+    held = [[] for _ in plan]
+    done = set()
+    steps = []
+    now = 0
+    while ready or running:
+        postponed = []
+        while ready and free_crafters:
+            priority, index = heappop(ready)
+            chosen = []
+            for item, candidates in tools[index]:
+                unit = next((unit for unit in candidates
+                             if unit not in in_use and (unit[1] is None or unit[1] in done)), None)
+                if unit is None:
+                    break
+                chosen.append(unit)
+            if len(chosen) < len(tools[index]):
+                postponed.append((priority, index))
+                continue
+            crafter = free_crafters.pop(0)
+            end = now + crafting['Recipes'][plan[index]]['Time']
+            held[index] = chosen
+            in_use.update(chosen)
+            steps.append(ScheduledStep(index, plan[index], crafter, now, end))
+            heappush(running, (end, index, crafter))
+        for entry in postponed:
+            heappush(ready, entry)
+        if not running:
+            break
+        now, index, crafter = heappop(running)
+        finished = [(index, crafter)]
+        while running and running[0][0] == now:
+            _, other, other_crafter = heappop(running)
+            finished.append((other, other_crafter))
+        for index, crafter in finished:
+            free_crafters.append(crafter)
+            done.add(index)
+            in_use.difference_update(held[index])
+            for after in successors[index]:
+                waiting[after] -= 1
+                if waiting[after] == 0:
+                    heappush(ready, (-remaining[after], after))
+        free_crafters.sort()
+    sequential_cost = sum(crafting['Recipes'][name]['Time'] for name in plan)
+    lower_bound = max(max(remaining or [0]), -(-sequential_cost // crafters))
+    makespan = max([step.end for step in steps] or [0])
+    return Schedule(makespan, sequential_cost, lower_bound, sorted(steps, key=lambda step: (step.start, step.crafter)))
+
+
+def print_schedule(schedule):
+    for step in schedule.steps:
+        print("%4d-%-4d crafter %d: %s" % (step.start, step.end, step.crafter, step.name))
+    print("Sequential cost: " + str(schedule.sequential_cost))
+    print("Makespan: " + str(schedule.makespan) + " (lower bound " + str(schedule.lower_bound) + ")")
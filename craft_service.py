@@ -0,0 +1,220 @@
+import asyncio
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import craft_planner as planner
+
+worker_goals = 16
+modes = ('search', 'greedy', 'beam')
+
+
+class PlannerOverloaded(Exception):
+    pass
+
+
+class CancelFlag:
+    """ Cancellation token for SearchControl backed by one byte of an array shared with the
+        workers, so setting it in the server process stops the search in the worker.
+    """
+
+    def __init__(self, flags, slot):
+        self.flags = flags
+        self.slot = slot
+
+    def is_set(self):
+        return self.flags[self.slot] != 0
+
+
+# Per-process state of a worker: the recipe set, the shared cancel flags, and the rules compiled
+# for the most recently used goals.
+worker = {}
+
+
+def init_worker(crafting, flags):
+    worker['crafting'] = crafting
+    worker['flags'] = flags
+    worker['goals'] = OrderedDict()
+    compile_goal(crafting['Goal'])
+
+
+def compile_goal(goal):
+    # Prunes the recipe set for the goal and builds its rules and bulk graph the way the main
+    # script does, keeping the last worker_goals of them. Returns None if the goal is unsolvable.
+    key = tuple(sorted(goal.items()))
+    if key in worker['goals']:
+        worker['goals'].move_to_end(key)
+        return worker['goals'][key]
+    crafting = dict(worker['crafting'], Goal=dict(goal))
+    crafting, _ = planner.prune_irrelevant(crafting)
+    reachability = planner.check_reachability(crafting)
+    compiled = None
+    if reachability.solvable:
+        heuristic = planner.make_heuristic(goal)
+        if planner.use_cost_to_go:
+            # The table is memory-mapped, so workers planning for the same goal share it.
+            from craft_cost_to_go import get_cost_to_go, make_cost_to_go_heuristic
+            heuristic = make_cost_to_go_heuristic(get_cost_to_go(crafting), heuristic)
+        rules, _ = planner.build_rules(crafting, planner.HeuristicCache(heuristic))
+        planner.all_recipes = rules
+        successors = planner.make_bulk_graph(crafting, planner.item_demand(crafting, reachability))
+        compiled = (crafting, rules, successors, planner.make_commutativity(crafting),
+                    planner.make_goal_checker(goal))
+    worker['goals'][key] = compiled
+    if len(worker['goals']) > worker_goals:
+        worker['goals'].popitem(last=False)
+    return compiled
+
+
+def run_request(slot, goal, initial, limit, mode):
+    # Runs one search in a worker. Returns (plan, computation time, number of states), or None if
+    # there is no plan, the search ran out of budget, or it was cancelled.
+    control = planner.SearchControl(limit, cancelled=CancelFlag(worker['flags'], slot), check_every=32)
+    if control.cancelled.is_set():
+        return None
+    compiled = compile_goal(goal)
+    if compiled is None:
+        return None
+    crafting, rules, successors, pruned_after, is_goal = compiled
+    planner.all_recipes = rules
+    state = planner.State({item: 0 for item in crafting['Items']})
+    state.update((item, quantity) for item, quantity in initial.items() if item in state)
+    if mode == 'greedy':
+        results = planner.greedy_search(successors, state, is_goal, limit, control=control)
+    elif mode == 'beam':
+        results = planner.beam_search(successors, state, is_goal, limit, planner.beam_width, control=control)
+    else:
+        results = planner.search(successors, state, is_goal, limit, pruned_after, control=control)
+    if results is None:
+        return None
+    return (planner.expand_bulk(results[0]), results[1], results[2])
+
+
+class AsyncPlanner:
+    """ asyncio facade over the search engines. Searches run in a pool of worker processes which
+        load the recipe set once, so the event loop is never blocked.
+
+        At most max_pending requests are handed to the pool at a time; up to max_waiting more wait
+        for a turn, and any beyond that are rejected with PlannerOverloaded straight away.
+        Each request owns a cancel flag for as long as a worker may be using it: when the caller
+        is cancelled or its timeout expires, the flag is set and the worker's search stops at
+        its next control check, or before starting if it hasn't yet.
+    """
+
+    def __init__(self, crafting, workers=None, max_pending=None, max_waiting=64):
+        self.crafting = crafting
+        workers = workers or os.cpu_count()
+        self.max_pending = max_pending or 2 * workers
+        self.max_waiting = max_waiting
+        self.queued = 0
+        self.flags = multiprocessing.Array('b', self.max_pending, lock=False)
+        self.free = list(range(self.max_pending))
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self.pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(crafting, self.flags))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for slot in range(self.max_pending):
+            self.flags[slot] = 1
+        self.pool.shutdown(wait=True)
+
+    def release(self, slot):
+        self.free.append(slot)
+        self.slots.release()
+        self.queued -= 1
+
+    async def plan(self, goal=None, initial=None, timeout=30, mode='search'):
+        # Plans from initial (Crafting['Initial'] by default) to goal (Crafting['Goal'] by
+        # default) with the search(), greedy_search() or beam_search() engine. Returns the same
+        # as run_request(). Raises asyncio.TimeoutError if no answer came within timeout seconds,
+        # counted from the call, and PlannerOverloaded if the queue is full.
+        if mode not in modes:
+            raise ValueError("Unknown search mode: " + str(mode))
+        if self.queued >= self.max_pending + self.max_waiting:
+            raise PlannerOverloaded(self.queued)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except BaseException:
+            self.queued -= 1
+            raise
+        slot = self.free.pop()
+        self.flags[slot] = 0
+        goal = goal if goal is not None else self.crafting['Goal']
+        initial = initial if initial is not None else self.crafting['Initial']
+        future = loop.run_in_executor(self.pool, run_request, slot, goal, initial, max(deadline - loop.time(), 0),
+                                      mode)
+        # The slot is only released once the worker is done with it; releasing it earlier would
+        # let a new request clear the flag of a search that is still stopping.
+        future.add_done_callback(lambda _: self.release(slot))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # Once the future is done its slot may already belong to another request.
+            if not future.done():
+                self.flags[slot] = 1
+            raise
+
+
+async def load_test(planner_service, goals, clients, requests, timeout, mode):
+    # Local load generator: clients coroutines each issue requests in turn, cycling over goals.
+    # Returns the sorted latencies of the answered requests, and counts of each outcome.
+    loop = asyncio.get_running_loop()
+    latencies = []
+    outcomes = {'planned': 0, 'no plan': 0, 'timeout': 0, 'overloaded': 0}
+
+    async def client(index):
+        for n in range(requests):
+            start = loop.time()
+            try:
+                results = await planner_service.plan(goals[(index + n) % len(goals)], None, timeout, mode)
+            except asyncio.TimeoutError:
+                outcomes['timeout'] += 1
+                continue
+            except PlannerOverloaded:
+                outcomes['overloaded'] += 1
+                await asyncio.sleep(0.01)
+                continue
+            latencies.append(loop.time() - start)
+            outcomes['planned' if results is not None else 'no plan'] += 1
+
+    await asyncio.gather(*[client(index) for index in range(clients)])
+    return sorted(latencies), outcomes
+
+
+async def benchmark(crafting, goals, workers, clients, requests, timeout=5, mode='search'):
+    async with AsyncPlanner(crafting, workers) as planner_service:
+        await planner_service.plan(None, None, timeout, mode)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        latencies, outcomes = await load_test(planner_service, goals, clients, requests, timeout, mode)
+        elapsed = loop.time() - start
+    print("Workers: %d, clients: %d, requests: %d" % (workers, clients, clients * requests))
+    print("Outcomes: " + ", ".join("%s %d" % entry for entry in outcomes.items()))
+    print("Throughput: %.1f requests/second" % (len(latencies) / elapsed))
+    if latencies:
+        print("Latency p50 %.1f ms, p90 %.1f ms, p99 %.1f ms" % tuple(
+            1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))] for p in (0.5, 0.9, 0.99)))
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    # Usage: python craft_service.py [workers] [clients] [requests per client] [mode]
+    with open('Crafting.json') as f:
+        Crafting = json.load(f)
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    mode = sys.argv[4] if len(sys.argv) > 4 else 'search'
+    goals = [{'stone_pickaxe': 1}, {'wooden_pickaxe': 1}, {'furnace': 1}, {'iron_pickaxe': 1},
+             {'cart': 1}, {'rail': 20}, {'bench': 1}, {'wood': 5}]
+    asyncio.run(benchmark(Crafting, goals, workers, clients, requests, mode=mode))
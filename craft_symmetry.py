@@ -0,0 +1,218 @@
+from collections import namedtuple, defaultdict, Counter
+
+import craft_planner as planner
+
+Symmetry = namedtuple('Symmetry', ['items', 'generators', 'orbits', 'duplicates', 'recipe_names'])
+
+
+def rule_key(rule, rename=None):
+    # What a recipe does, without its name, with items renamed through rename when given.
+    rename = rename or {}
+    return (rule['Time'],
+            tuple(sorted((rename.get(item, item), quantity) for item, quantity in rule['Produces'].items())),
+            tuple(sorted((rename.get(item, item), quantity) for item, quantity in rule.get('Consumes', {}).items())),
+            tuple(sorted(rename.get(item, item) for item in rule.get('Requires', {}).keys())))
+
+
+def recipe_graph(crafting):
+    # The bipartite graph of items and recipes, with one edge per Produces, Consumes and Requires
+    # entry labelled by its role and quantity. Items come first, in crafting['Items'] order.
+    items = list(crafting['Items'])
+    index = {item: i for i, item in enumerate(items)}
+    adjacency = [[] for _ in items]
+    colors = [hash(('item', crafting['Goal'].get(item, 0))) for item in items]
+    for rule in crafting['Recipes'].values():
+        recipe = len(adjacency)
+        adjacency.append([])
+        colors.append(hash(('recipe', rule['Time'])))
+        edges = [(item, ('P', quantity)) for item, quantity in rule['Produces'].items()]
+        edges += [(item, ('C', quantity)) for item, quantity in rule.get('Consumes', {}).items()]
+        edges += [(item, ('R', 0)) for item in rule.get('Requires', {}).keys()]
+        for item, label in edges:
+            adjacency[recipe].append((index[item], label))
+            adjacency[index[item]].append((recipe, label))
+    return items, adjacency, colors
+
+
+def refine(colors, adjacency):
+    # Colour refinement: recolours every vertex by its colour and the multiset of its labelled
+    # neighbours' colours until the partition stops splitting. Vertices an automorphism can swap
+    # always end up the same colour.
+    count = len(set(colors))
+    while True:
+        colors = [hash((colors[v], tuple(sorted((label, colors[u]) for u, label in adjacency[v]))))
+                  for v in range(len(colors))]
+        if len(set(colors)) == count:
+            return colors
+        count = len(set(colors))
+
+
+def find_automorphism(adjacency, colors, a, b):
+    # Looks for an automorphism mapping vertex a to b by individualization and refinement: a and b
+    # get the same fresh colour in two copies of the colouring, then the first vertices of
+    # matching non-singleton cells are paired up the same way until every cell is a singleton.
+    # There is no backtracking, so this can miss automorphisms; it returns the vertex mapping it
+    # ended up with, or None, and the caller must check the mapping is really an automorphism.
+    source, target = list(colors), list(colors)
+    marker = 0
+    x, y = a, b
+    while True:
+        source[x] = target[y] = hash(('individualized', marker))
+        source, target = refine(source, adjacency), refine(target, adjacency)
+        if sorted(source) != sorted(target):
+            return None
+        source_cells, target_cells = defaultdict(list), defaultdict(list)
+        for v, color in enumerate(source):
+            source_cells[color].append(v)
+        for v, color in enumerate(target):
+            target_cells[color].append(v)
+        cells = [color for color, members in source_cells.items() if len(members) > 1]
+        if not cells:
+            break
+        color = min(cells)
+        marker += 1
+        x, y = source_cells[color][0], target_cells[color][0]
+    position = dict((color, v) for v, color in enumerate(target))
+    return [position[color] for color in source]
+
+
+def preserves(crafting, items, perm):
+    # Whether renaming item i to item perm[i] maps the recipe set and the goal onto themselves.
+    rename = dict((items[i], items[perm[i]]) for i in range(len(items)))
+    goal = crafting['Goal']
+    if any(goal.get(item, 0) != goal.get(rename[item], 0) for item in items):
+        return False
+    rules = crafting['Recipes'].values()
+    return Counter(rule_key(rule) for rule in rules) == Counter(rule_key(rule, rename) for rule in rules)
+
+
+def find_symmetries(crafting):
+    # Finds item permutations preserving the recipes and the goal (the initial inventory needn't
+    # be symmetric: the search starts from its canonical form). One generator is kept for each
+    # pair of items first found to be interchangeable; orbits are the sets of items the generators
+    # can move into each other. Recipes identical to an earlier one are listed as duplicates.
+    items, adjacency, colors = recipe_graph(crafting)
+    colors = refine(colors, adjacency)
+    orbit = list(range(len(items)))
+
+    def find(i):
+        while orbit[i] != i:
+            orbit[i] = orbit[orbit[i]]
+            i = orbit[i]
+        return i
+
+    generators = []
+    for a in range(len(items)):
+        for b in range(a + 1, len(items)):
+            if colors[a] != colors[b] or find(a) == find(b):
+                continue
+            mapping = find_automorphism(adjacency, colors, a, b)
+            if mapping is None or not preserves(crafting, items, mapping[:len(items)]):
+                continue
+            perm = mapping[:len(items)]
+            generators.append(perm)
+            for i, j in enumerate(perm):
+                orbit[find(i)] = find(j)
+    orbits = defaultdict(list)
+    for i, item in enumerate(items):
+        orbits[find(i)].append(item)
+    recipe_names = {}
+    duplicates = []
+    for name, rule in crafting['Recipes'].items():
+        key = rule_key(rule)
+        if key in recipe_names:
+            duplicates.append(name)
+        else:
+            recipe_names[key] = name
+    return Symmetry(items, generators, [orbit for orbit in orbits.values() if len(orbit) > 1], duplicates,
+                    recipe_names)
+
+
+def make_canonicalizer(symmetry):
+    # Returns canonical(state) -> (representative, perm), where the representative is reached by
+    # applying generators (and their inverses) for as long as one makes the vector of quantities
+    # lexicographically larger, and perm is the permutation applied overall: the quantity of item
+    # i ends up at item perm[i]. Symmetric states usually, though not always, get the same
+    # representative; the search is correct either way. States must list their items in
+    # symmetry.items order.
+    moves = []
+    for perm in symmetry.generators:
+        inverse = [0] * len(perm)
+        for i, j in enumerate(perm):
+            inverse[j] = i
+        for move in (perm, inverse):
+            if move not in moves:
+                moves.append(move)
+    identity = list(range(len(symmetry.items)))
+
+    def canonical(state):
+        values = list(state.values())
+        perm = identity
+        improved = True
+        while improved:
+            improved = False
+            for move in moves:
+                moved = [0] * len(values)
+                for i, quantity in enumerate(values):
+                    moved[move[i]] = quantity
+                if moved > values:
+                    values = moved
+                    perm = [move[j] for j in perm]
+                    improved = True
+        if perm is identity:
+            return state, perm
+        return planner.State(zip(state.keys(), values)), perm
+
+    return canonical
+
+
+def make_symmetric_graph(graph, symmetry):
+    # Returns graph() with every successor replaced by its canonical representative and duplicate
+    # recipes left out, so search() detects symmetric states as duplicates in times. Recipe names
+    # along the path refer to canonical states; concrete_plan() maps them back.
+    canonical = make_canonicalizer(symmetry)
+    duplicates = frozenset(symmetry.duplicates)
+
+    def symmetric_graph(state, skip=()):
+        for name, resulting_state, time_cost, heuristic in graph(state, duplicates.union(skip) if skip else duplicates):
+            yield (name, canonical(resulting_state)[0], time_cost, heuristic)
+
+    return symmetric_graph
+
+
+def map_recipe(symmetry, crafting, name, perm):
+    rename = dict((item, symmetry.items[perm[i]]) for i, item in enumerate(symmetry.items))
+    return symmetry.recipe_names[rule_key(crafting['Recipes'][name], rename)]
+
+
+def concrete_plan(path, state, symmetry, crafting):
+    # Turns a path found with make_symmetric_graph() from canonical(state) back into recipe names
+    # applicable from state itself, replaying it to track which permutation relates each
+    # canonical state to the concrete one. Bulk steps keep their count.
+    canonical = make_canonicalizer(symmetry)
+    effects = {}
+    current, perm = canonical(state)
+    plan = []
+    for step in path:
+        name, _, count = step.rpartition(planner.bulk_separator)
+        suffix = planner.bulk_separator + count
+        if not (name and count.isdigit()):
+            name, count, suffix = step, '1', ''
+        inverse = [0] * len(perm)
+        for i, j in enumerate(perm):
+            inverse[j] = i
+        plan.append(map_recipe(symmetry, crafting, name, inverse) + suffix)
+        if name not in effects:
+            effects[name] = planner.make_effector(crafting['Recipes'][name])
+        for _ in range(int(count)):
+            current = effects[name](current)
+        current, moved = canonical(current)
+        perm = [moved[j] for j in perm]
+    return plan
+
+
+def print_symmetry_report(symmetry):
+    print("Symmetry: " + str(len(symmetry.generators)) + " generators, " + str(len(symmetry.duplicates)) +
+          " duplicate recipes")
+    for orbit in symmetry.orbits:
+        print("  interchangeable: " + ", ".join(orbit))
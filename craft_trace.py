@@ -0,0 +1,130 @@
+import json
+import struct
+from collections import Counter
+
+import numpy as np
+
+# A trace file is the magic, then one fixed-size record per event, then a trailer holding the
+# recipe names as JSON followed by its length. Records are (kind, node id, parent id, recipe id,
+# g, h, f), with kind EXPAND when a node is taken off the queue and GOAL for the goal node.
+# Parent and recipe ids are -1 for the start node.
+magic = b'CRAFTTR1'
+record = struct.Struct('<Biiifff')
+record_dtype = np.dtype([('kind', 'u1'), ('node', '<i4'), ('parent', '<i4'), ('recipe', '<i4'),
+                         ('g', '<f4'), ('h', '<f4'), ('f', '<f4')])
+trailer = struct.Struct('<Q')
+EXPAND = 0
+GOAL = 1
+buffer_bytes = 1 << 16
+
+
+class TraceRecorder:
+    """ Records the expansions of a search() or backsearch() run to a binary trace file. The
+        search reports each improved successor to generated() and each node it pops to expanded();
+        the recorder tracks node ids and g-values itself, so the search needs no extra state.
+        Records are collected in a buffer and written out buffer_bytes at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(magic)
+        self.buffer = bytearray()
+        self.nodes = {}
+        self.recipes = {}
+
+    def start(self, state):
+        # The search never evaluates the heuristic on the start node, so its h is recorded as NaN.
+        self.nodes[state] = [0, -1, -1, 0, float('nan')]
+
+    def generated(self, state, parent, name, time_cost, h):
+        # node is [id, parent id, recipe id, g, h]; a reopened state keeps its id.
+        parent_node = self.nodes[parent]
+        node = self.nodes.get(state)
+        if node is None:
+            node = self.nodes[state] = [len(self.nodes), 0, 0, 0, 0]
+        recipe = self.recipes.get(name)
+        if recipe is None:
+            recipe = self.recipes[name] = len(self.recipes)
+        node[1:] = [parent_node[0], recipe, parent_node[3] + time_cost, h]
+
+    def expanded(self, state, f, kind=EXPAND):
+        node = self.nodes[state]
+        self.buffer += record.pack(kind, node[0], node[1], node[2], node[3], node[4], f)
+        if len(self.buffer) >= buffer_bytes:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+
+    def goal(self, state, f):
+        self.expanded(state, f, GOAL)
+
+    def close(self):
+        names = sorted(self.recipes, key=self.recipes.get)
+        encoded = json.dumps(names).encode()
+        self.file.write(self.buffer)
+        self.file.write(encoded)
+        self.file.write(trailer.pack(len(encoded)))
+        self.file.close()
+        self.buffer = bytearray()
+
+
+def read_trace(path):
+    # Returns the records as a structured array, and the recipe names indexed by recipe id.
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(magic):
+        raise ValueError(path + " is not a search trace")
+    length, = trailer.unpack_from(data, len(data) - trailer.size)
+    names = json.loads(data[len(data) - trailer.size - length:len(data) - trailer.size])
+    body = data[len(magic):len(data) - trailer.size - length]
+    return np.frombuffer(body, dtype=record_dtype), names
+
+
+def analyze_trace(records, names, top=10):
+    # Expansions per depth, the heuristic's error along the plan found (h against the cost the
+    # plan actually spent from that node on), and the recipes whose results were expanded most.
+    parent, recipe, g, h = {}, {}, {}, {}
+    depth = {}
+    for row in records:
+        node = int(row['node'])
+        parent[node], recipe[node], g[node], h[node] = int(row['parent']), int(row['recipe']), \
+            float(row['g']), float(row['h'])
+        depth[node] = depth[parent[node]] + 1 if parent[node] >= 0 else 0
+    expansions = records[records['kind'] == EXPAND]
+    per_depth = Counter(depth[int(node)] for node in expansions['node'])
+    fired = Counter(names[r] for r in expansions['recipe'] if r >= 0)
+    plan = []
+    goals = records[records['kind'] == GOAL]
+    if len(goals):
+        node = int(goals[-1]['node'])
+        cost = g[node]
+        while node >= 0:
+            plan.append((node, names[recipe[node]] if recipe[node] >= 0 else None, h[node], cost - g[node]))
+            node = parent[node]
+        plan.reverse()
+    return {'expansions': len(expansions), 'per_depth': sorted(per_depth.items()),
+            'fired': fired.most_common(top), 'plan': plan}
+
+
+def print_trace_report(report):
+    print("Expansions: " + str(report['expansions']))
+    print("Expansions per depth:")
+    for depth, count in report['per_depth']:
+        print("%6d %8d" % (depth, count))
+    print("Most-fired recipes:")
+    for name, count in report['fired']:
+        print("%8d  %s" % (count, name))
+    if not report['plan']:
+        print("No goal reached.")
+        return
+    print("Heuristic along the plan (h, actual cost-to-go, error):")
+    for node, name, h, actual in report['plan']:
+        print("%10.1f %8.1f %+10.1f  %s" % (h, actual, h - actual, name or '(start)'))
+    errors = [abs(h - actual) for _, _, h, actual in report['plan'] if h == h]
+    print("Mean absolute heuristic error: %.1f" % (sum(errors) / len(errors)))
+
+
+if __name__ == '__main__':
+    import sys
+    # Usage: python craft_trace.py trace.bin
+    print_trace_report(analyze_trace(*read_trace(sys.argv[1])))
@@ -0,0 +1,117 @@
+import json
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+CompiledRecipes = namedtuple('CompiledRecipes', ['items', 'names', 'need', 'delta', 'time'])
+Validation = namedtuple('Validation', ['valid', 'failed_step', 'missing', 'final', 'goal_met', 'time'])
+
+
+def compile_recipes(crafting):
+    # Compiles the recipe set into matrices with one row per recipe and one column per item:
+    # need holds the least quantity of each item the recipe checks for (its Consumes amount, or 1
+    # for a Requires), delta the net change its effect makes, and time its Time.
+    items = list(crafting['Items'])
+    names = list(crafting['Recipes'].keys())
+    index = {item: i for i, item in enumerate(items)}
+    need = np.zeros((len(names), len(items)), dtype=np.int64)
+    delta = np.zeros((len(names), len(items)), dtype=np.int64)
+    time = np.zeros(len(names), dtype=np.int64)
+    for r, name in enumerate(names):
+        rule = crafting['Recipes'][name]
+        for item in rule.get('Requires', {}).keys():
+            need[r, index[item]] = 1
+        for item, quantity in rule.get('Consumes', {}).items():
+            need[r, index[item]] = max(need[r, index[item]], quantity)
+            delta[r, index[item]] -= quantity
+        for item, quantity in rule['Produces'].items():
+            delta[r, index[item]] += quantity
+        time[r] = rule['Time']
+    return CompiledRecipes(items, names, need, delta, time)
+
+
+def inventory_matrix(compiled, inventories):
+    index = {item: i for i, item in enumerate(compiled.items)}
+    matrix = np.zeros((len(inventories), len(compiled.items)), dtype=np.int64)
+    for p, inventory in enumerate(inventories):
+        for item, quantity in inventory.items():
+            matrix[p, index[item]] = quantity
+    return matrix
+
+
+def validate_plans(compiled, plans, initials, goals):
+    # Replays every plan at once, one step per iteration over the whole batch. A plan stops at its
+    # first step whose recipe is unknown or whose check fails; later steps are ignored for it.
+    # The goal test matches make_goal_checker: every goal item at least its goal quantity.
+    recipe_index = {name: r for r, name in enumerate(compiled.names)}
+    length = max([len(plan) for plan in plans] or [0])
+    steps = np.full((len(plans), length), -1, dtype=np.int64)
+    unknown = np.full(len(plans), -1, dtype=np.int64)
+    for p, plan in enumerate(plans):
+        for t, name in enumerate(plan):
+            if name not in recipe_index:
+                unknown[p] = t
+                break
+            steps[p, t] = recipe_index[name]
+    state = inventory_matrix(compiled, initials)
+    goal = inventory_matrix(compiled, goals)
+    failed_step = np.full(len(plans), -1, dtype=np.int64)
+    missing = np.zeros_like(state)
+    total_time = np.zeros(len(plans), dtype=np.int64)
+    alive = np.ones(len(plans), dtype=bool)
+    for t in range(length):
+        stopped = alive & (unknown == t)
+        failed_step[stopped] = t
+        alive &= ~stopped
+        active = alive & (steps[:, t] >= 0)
+        if not active.any():
+            continue
+        rows = np.nonzero(active)[0]
+        recipes = steps[rows, t]
+        shortfall = np.maximum(compiled.need[recipes] - state[rows], 0)
+        ok = ~shortfall.any(axis=1)
+        failed = rows[~ok]
+        failed_step[failed] = t
+        missing[failed] = shortfall[~ok]
+        alive[failed] = False
+        applied = rows[ok]
+        state[applied] += compiled.delta[recipes[ok]]
+        total_time[applied] += compiled.time[recipes[ok]]
+    goal_met = alive & (state >= goal).all(axis=1)
+    results = []
+    for p in range(len(plans)):
+        results.append(Validation(
+            bool(alive[p]),
+            None if alive[p] else int(failed_step[p]),
+            dict((compiled.items[i], int(q)) for i, q in enumerate(missing[p]) if q > 0),
+            dict((compiled.items[i], int(q)) for i, q in enumerate(state[p]) if q > 0),
+            bool(goal_met[p]),
+            int(total_time[p])))
+    return results
+
+
+def read_plans(path, crafting):
+    # Each line is either a list of recipe names, or an object with a 'plan' list and optionally
+    # 'Initial' and 'Goal' inventories overriding the ones in the recipe file.
+    plans, initials, goals = [], [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, list):
+                entry = {'plan': entry}
+            plans.append(entry['plan'])
+            initials.append(entry.get('Initial', crafting['Initial']))
+            goals.append(entry.get('Goal', crafting['Goal']))
+    return plans, initials, goals
+
+
+if __name__ == '__main__':
+    # Usage: python craft_validator.py Crafting.json plans.jsonl > results.jsonl
+    with open(sys.argv[1]) as f:
+        Crafting = json.load(f)
+    plans, initials, goals = read_plans(sys.argv[2], Crafting)
+    for result in validate_plans(compile_recipes(Crafting), plans, initials, goals):
+        print(json.dumps(result._asdict()))
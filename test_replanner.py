@@ -0,0 +1,38 @@
+import unittest
+
+from craft_replanner import Replanner
+
+# A two-recipe world small enough to check plans by hand.
+Crafting = {
+    'Items': ['wood', 'pickaxe'],
+    'Initial': {},
+    'Goal': {'pickaxe': 1},
+    'Recipes': {
+        'punch for wood': {'Produces': {'wood': 1}, 'Time': 4},
+        'craft pickaxe': {'Produces': {'pickaxe': 1}, 'Consumes': {'wood': 1}, 'Time': 1},
+    },
+}
+
+
+class ReplannerTest(unittest.TestCase):
+
+    def test_dearer_recipe_then_losing_goal(self):
+        # The goal is held, so the regression through 'craft pickaxe' is still queued when the
+        # recipe gets dearer; it must survive for the plan after the pickaxe is lost.
+        replanner = Replanner(Crafting, {'pickaxe': 1})
+        self.assertEqual(replanner.plan()[0], [])
+        replanner.update_cost('craft pickaxe', 2)
+        results = replanner.update_inventory({'pickaxe': -1})
+        self.assertIsNotNone(results)
+        self.assertEqual(results[0], ['punch for wood', 'craft pickaxe'])
+
+    def test_updates_match_fresh_plan(self):
+        replanner = Replanner(Crafting, {'wood': 1})
+        self.assertEqual(replanner.plan()[0], ['craft pickaxe'])
+        self.assertEqual(replanner.update_inventory({'wood': -1})[0], ['punch for wood', 'craft pickaxe'])
+        replanner.update_cost('punch for wood', 1)
+        self.assertEqual(replanner.update_inventory({'pickaxe': 1})[0], [])
+
+
+if __name__ == '__main__':
+    unittest.main()